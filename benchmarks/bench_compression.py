@@ -0,0 +1,76 @@
+"""
+CPU cost of body compression against the bytes it saves.
+
+Builds `{PREFIX_ID}_NOTIFY_ZALO` style messages with `Params` blobs of
+typical sizes and times `compress_body` / `decompress_body` for each
+encoding and level.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_compression [--repeat 200]
+"""
+import json
+import random
+import argparse
+import time
+import uuid
+
+from models.compression import GZIP, DEFLATE, compress_body, decompress_body
+
+# Approximate Params blob size of the messages seen in production
+PAYLOAD_SIZES = (256, 1024, 4 * 1024, 16 * 1024, 64 * 1024)
+LEVELS = (1, 6, 9)
+
+def build_message(params_size: int, rng: random.Random) -> bytes:
+    """DOWNLOAD_IMAGE message whose Params hold about `params_size` bytes of image metadata"""
+    images = []
+    while len(json.dumps(images)) < params_size:
+        images.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "path": f"\\exports\\{rng.randint(1000, 9999)}\\IMG_{rng.randint(0, 99999):05d}.jpg",
+            "width": rng.choice((1080, 1440, 2048, 4032)),
+            "height": rng.choice((720, 1080, 1536, 3024)),
+            "size": rng.randint(50_000, 5_000_000),
+        })
+    task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    payload = {
+        "TaskId": task_id,
+        "ActionType": "DOWNLOAD_IMAGE",
+        "PhoneNumber": "0901234567",
+        "Message": "Ảnh của bạn đã sẵn sàng để tải về",
+        "ZipFileUrl": f"\\exports\\{task_id}.zip",
+        "Params": {"images": images},
+    }
+    return f"BGTASK|DOWNLOAD_IMAGE|{task_id}#{json.dumps(payload, ensure_ascii=False)}".encode("utf-8")
+
+def measure(func, repeat: int) -> float:
+    """Mean duration of `func()` in microseconds"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="iterations per measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    header = f"{'params':>8} {'body':>8} {'enc':>8} {'lvl':>3} {'packed':>8} {'saved':>6} {'comp us':>9} {'decomp us':>9} {'us/KB saved':>11}"
+    print(header)
+    print("-" * len(header))
+    for size in PAYLOAD_SIZES:
+        body = build_message(size, rng)
+        for encoding in (GZIP, DEFLATE):
+            for level in LEVELS:
+                packed, used = compress_body(body, threshold=1, encoding=encoding, level=level)
+                compress_us = measure(lambda: compress_body(body, 1, encoding, level), args.repeat)
+                decompress_us = measure(lambda: decompress_body(packed, used), args.repeat) if used else 0.0
+                saved = len(body) - len(packed)
+                per_kb = (compress_us + decompress_us) / (saved / 1024) if saved else float("inf")
+                print(
+                    f"{size:>8} {len(body):>8} {encoding:>8} {level:>3} {len(packed):>8} "
+                    f"{saved / len(body):>6.0%} {compress_us:>9.1f} {decompress_us:>9.1f} {per_kb:>11.2f}"
+                )
+
+if __name__ == "__main__":
+    main()
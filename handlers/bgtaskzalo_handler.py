@@ -1,11 +1,13 @@
-import time
-import random
 import json
+import time
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, List
 from uuid import UUID
 
 from interfaces import IZaloBot
+from models.retry import TransientError, PermanentError
+from models.notification_scheduler import SCHEDULED_JOB_HEADER
 from utils.config import get_base_url
 from utils.logger import get_logger
 
@@ -17,97 +19,247 @@ class BgTaskNotifyZalo(BaseModel):
     zip_file_url: str | None
     params: Dict[str, Any] | None
 
-def on_notify_download_image(ch, method, properties, body, bot: IZaloBot = None, **kwargs):
-    logger = kwargs.get("logger") or get_logger("MessageHandler")
-    text = body.decode('utf-8')
+    def due_at(self) -> float | None:
+        """
+        When to send the notification (epoch seconds), None to send it now.
 
-    try:
-        # Payload format: <part1>|<part2>|<taskId>#<payload>
-        taskId , payload_str = text.split("|")[-1].split("#")
+        Params `send_at` (epoch seconds, or ISO 8601, local time if no offset)
+        or `delay` (seconds from now).
+        """
+        params = self.params or {}
+        send_at = params.get("send_at")
+        delay = params.get("delay")
+        try:
+            if send_at is not None:
+                if isinstance(send_at, (int, float)):
+                    return float(send_at)
+                return datetime.fromisoformat(str(send_at)).timestamp()
+            if delay is not None:
+                return time.time() + float(delay)
+        except (TypeError, ValueError) as e:
+            raise PermanentError(f"Invalid send_at/delay in the payload: {e}")
+        return None
+
+def parse_payload(body: bytes, logger=None) -> BgTaskNotifyZalo:
+    """
+    Parse a message body into a `BgTaskNotifyZalo`.
+
+    Raises:
+        ValueError: If the message format is invalid.
+    """
+    text = body.decode('utf-8')
+    # Payload format: <part1>|<part2>|<taskId>#<payload>
+    taskId, payload_str = text.split("|")[-1].split("#", 1)
+    if logger:
         logger.info(f"Received message - Task ID: {taskId} - Payload: {payload_str}")
 
-        payload_data = json.loads(payload_str)
-        params = payload_data.get("Params") or {}
-        payload = BgTaskNotifyZalo(
+    payload_data = json.loads(payload_str)
+    try:
+        return BgTaskNotifyZalo(
             task_id=payload_data["TaskId"],
             action_type=payload_data["ActionType"],
             phone_number=payload_data["PhoneNumber"],
             message=payload_data["Message"],
             zip_file_url=payload_data["ZipFileUrl"],
-            params=params
+            params=payload_data.get("Params") or {}
         )
-        zip_file_path = payload.zip_file_url.replace('\\', '/')
-        notify_message = f"{payload.message} {get_base_url()}{zip_file_path}"
-
-        if bot is None:
-            logger.error("ZaloBot is None. Stop processing.")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-        
-        bot.send_message(phone_number=payload.phone_number, message=notify_message)
-    except ValueError as e:
-        logger.error(f"Invalid message format: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        bot.send_message(phone_number=payload.phone_number, message="Đã có lỗi trong trong quá trình xử lý xuất ảnh. Thử lại sau.")
-        return
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        bot.send_message(phone_number=payload.phone_number, message="Đã có lỗi trong trong quá trình xử lý xuất ảnh. Thử lại sau.")
+    except KeyError as e:
+        raise ValueError(f"Missing field {e} in the payload.")
+
+def get_recipient(body: bytes) -> str:
+    """Phone number a message is sent to, used to coalesce notifications"""
+    return parse_payload(body).phone_number
+
+def _download_url(payload: BgTaskNotifyZalo, base_url: str | None = None) -> str:
+    if not payload.zip_file_url:
+        raise PermanentError("Missing zip file url in the payload.")
+    zip_file_path = payload.zip_file_url.replace('\\', '/')
+    return f"{base_url or get_base_url()}{zip_file_path}"
+
+def _scheduled_at(properties, payload: BgTaskNotifyZalo) -> float | None:
+    """When a notification must be sent, None if it is due now"""
+    if properties is not None and SCHEDULED_JOB_HEADER in (properties.headers or {}):
+        # Published by the scheduler, it is due
+        return None
+    due_at = payload.due_at()
+    if due_at is None or due_at <= time.time():
+        return None
+    return due_at
+
+def defer_if_scheduled(ch, method, properties, body, payload: BgTaskNotifyZalo, **kwargs) -> bool:
+    """
+    Hand a notification due later to the scheduler and ack it.
+
+    Returns:
+        True if the notification was scheduled, False if it must be sent now.
+    """
+    due_at = _scheduled_at(properties, payload)
+    if due_at is None:
+        return False
+
+    scheduler = kwargs.get("scheduler")
+    if scheduler is None:
+        raise PermanentError("Scheduled notifications are not enabled.")
+    scheduler.schedule(str(payload.task_id), due_at, queue=kwargs.get("queue_name"), body=body)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    return True
+
+def on_notify_download_image(ch, method, properties, body, bot: IZaloBot = None, **kwargs):
+    logger = kwargs.get("logger") or get_logger("MessageHandler")
+    payload = parse_payload(body, logger)
+    if defer_if_scheduled(ch, method, properties, body, payload, **kwargs):
         return
-    
+    notify_message = f"{payload.message} {_download_url(payload, kwargs.get('base_url'))}"
+
+    if bot is None:
+        raise TransientError("ZaloBot is None. Stop processing.")
+
+    bot.send_message(phone_number=payload.phone_number, message=notify_message)
     ch.basic_ack(delivery_tag=method.delivery_tag)
     logger.info("Sent notification successfully.")
 
 def on_notify_otp(ch, method, properties, body, bot: IZaloBot = None, **kwargs):
     logger = kwargs.get("logger") or get_logger("MessageHandler")
-    text = body.decode('utf-8')
-    
-    try:
-        # Payload format: <part1>|<part2>|<taskId>#<payload>
-        taskId , payload_str = text.split("|")[-1].split("#")
-        logger.info(f"Received message - Task ID: {taskId} - Payload: {payload_str}")
+    payload = parse_payload(body, logger)
+    if defer_if_scheduled(ch, method, properties, body, payload, **kwargs):
+        return
 
-        payload_data = json.loads(payload_str)
-        params = payload_data.get("Params") or {}
-        payload = BgTaskNotifyZalo(
-            task_id=payload_data["TaskId"],
-            action_type=payload_data["ActionType"],
-            phone_number=payload_data["PhoneNumber"],
-            message=payload_data["Message"],
-            zip_file_url=payload_data["ZipFileUrl"],
-            params=params
-        )
+    params = payload.params or {}
+    otp = params.get("otp")
+    expire = params.get("expire")
+    if not all([otp, expire]):
+        raise PermanentError("Missing OTP or expire time in the payload.")
 
-        otp = params.get("otp")
-        expire = params.get("expire")
-        if not any([otp, expire]):
-            raise ValueError("Missing OTP or expire time in the payload.")
-
-        notify_message = payload.message.replace("<OTP>", otp).replace("<EXPIRE>", str(expire))
-
-        if bot is None:
-            logger.error("ZaloBot is None. Stop processing.")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-        
-        bot.send_message(phone_number=payload.phone_number, message=notify_message)
-    except ValueError as e:
-        logger.error(f"Invalid message format: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        bot.send_message(phone_number=payload.phone_number, message="Đã có lỗi trong quá trình gửi OTP. Thử lại sau.")
-        return
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        bot.send_message(phone_number=payload.phone_number, message="Đã có lỗi trong quá trình gửi OTP. Thử lại sau.")
-        return
-    
+    notify_message = (payload.message or "").replace("<OTP>", str(otp)).replace("<EXPIRE>", str(expire))
+
+    if bot is None:
+        raise TransientError("ZaloBot is None. Stop processing.")
+
+    bot.send_message(phone_number=payload.phone_number, message=notify_message)
     ch.basic_ack(delivery_tag=method.delivery_tag)
     logger.info("Sent notification successfully.")
 
+def on_notify_download_image_batch(deliveries: List[tuple], bot: IZaloBot = None, **kwargs):
+    """
+    Send the download links of several DOWNLOAD_IMAGE messages of the same
+    recipient as one Zalo message, then ack all the source deliveries.
+    """
+    logger = kwargs.get("logger") or get_logger("MessageHandler")
+    payloads = [parse_payload(body) for _, _, _, body in deliveries]
+    if len(payloads) == 1:
+        ch, method, properties, body = deliveries[0]
+        return on_notify_download_image(ch, method, properties, body, bot=bot, **kwargs)
+    if any(_scheduled_at(properties, payload) for (_, _, properties, _), payload in zip(deliveries, payloads)):
+        # Handled one by one by the consumer, each scheduled message is deferred on its own
+        raise PermanentError("Scheduled notifications are not coalesced.")
+
+    links = "\n".join(f"{i}. {_download_url(payload, kwargs.get('base_url'))}" for i, payload in enumerate(payloads, start=1))
+    notify_message = f"{payloads[0].message}\n{links}"
+
+    if bot is None:
+        raise TransientError("ZaloBot is None. Stop processing.")
+
+    bot.send_message(phone_number=payloads[0].phone_number, message=notify_message)
+    for ch, method, _, _ in deliveries:
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.info(f"Sent {len(payloads)} coalesced notifications successfully.")
+
+def on_cancel_scheduled(ch, method, properties, body, bot: IZaloBot = None, **kwargs):
+    """Cancel the scheduled notification whose task id is in the `task_id` param"""
+    logger = kwargs.get("logger") or get_logger("MessageHandler")
+    payload = parse_payload(body, logger)
+
+    task_id = (payload.params or {}).get("task_id")
+    if not task_id:
+        raise PermanentError("Missing task_id of the notification to cancel.")
+    scheduler = kwargs.get("scheduler")
+    if scheduler is None:
+        raise PermanentError("Scheduled notifications are not enabled.")
+
+    scheduler.cancel(str(task_id))
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+def on_broadcast(ch, method, properties, body, bot: IZaloBot = None, **kwargs):
+    """
+    Send `message` to many recipients as one tracked job.
+
+    Params: `recipients` (list of phone numbers), or `recipients_collection`
+    (one of BROADCAST_RECIPIENT_COLLECTIONS), `recipients_field` (default
+    "phone_number") and `recipients_query` (field: value equality filters).
+    `summary_queue` receives the final summary.
+    """
+    logger = kwargs.get("logger") or get_logger("MessageHandler")
+    payload = parse_payload(body, logger)
+    if defer_if_scheduled(ch, method, properties, body, payload, **kwargs):
+        return
+
+    params = payload.params or {}
+    recipients = params.get("recipients")
+    collection = params.get("recipients_collection")
+    if not payload.message:
+        raise PermanentError("Missing message to broadcast.")
+    if recipients is None and not collection:
+        raise PermanentError("Missing recipients or recipients_collection in the payload.")
+    if recipients is not None and not isinstance(recipients, list):
+        raise PermanentError("Recipients must be a list of phone numbers.")
+
+    runner = kwargs.get("broadcasts")
+    if runner is None:
+        raise PermanentError("Broadcasts are not enabled.")
+    if bot is None:
+        raise TransientError("ZaloBot is None. Stop processing.")
+
+    source = None
+    if recipients is None:
+        source = {
+            "collection": collection,
+            "field": params.get("recipients_field") or "phone_number",
+            "query": params.get("recipients_query") or {},
+        }
+    runner.submit(
+        str(payload.task_id),
+        bot,
+        queue=kwargs.get("queue_name"),
+        message=payload.message,
+        recipients=[str(phone) for phone in recipients] if recipients is not None else None,
+        source=source,
+        summary_queue=params.get("summary_queue")
+    )
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.info(f"Started broadcast {payload.task_id}.")
+
+# Message sent to the recipient when a notification is given up on
+FAILURE_NOTICES: Dict[str, str] = {
+    "DOWNLOAD_IMAGE": "Đã có lỗi trong trong quá trình xử lý xuất ảnh. Thử lại sau.",
+    "SEND_OTP": "Đã có lỗi trong quá trình gửi OTP. Thử lại sau."
+}
+
+def notify_failure(body, bot: IZaloBot = None, **kwargs):
+    """
+    Tell the recipient that their notification failed for good.
+
+    Called once a message is parked. Never raises: the notice is best effort.
+    """
+    logger = kwargs.get("logger") or get_logger("MessageHandler")
+    if bot is None:
+        return
+    try:
+        payload = parse_payload(body)
+        notice = FAILURE_NOTICES.get(payload.action_type)
+        if notice:
+            bot.send_message(phone_number=payload.phone_number, message=notice)
+    except Exception as e:
+        logger.warning(f"Failed to send failure notice: {e}")
+
 # Task registry
 TASK_REGISTRY: Dict[str, Callable] = {
     "DOWNLOAD_IMAGE": on_notify_download_image,
-    "SEND_OTP": on_notify_otp
-}
\ No newline at end of file
+    "SEND_OTP": on_notify_otp,
+    "CANCEL_SCHEDULED": on_cancel_scheduled,
+    "BROADCAST": on_broadcast
+}
+
+# Batch handlers of the action types that may be coalesced (OTP is time critical, never batched)
+COALESCE_REGISTRY: Dict[str, Callable] = {
+    "DOWNLOAD_IMAGE": on_notify_download_image_batch
+}
@@ -0,0 +1,17 @@
+from models.broadcast import BroadcastRunner
+from models.mongodb import MongoDB
+from utils.config import get_mongodb_db_name
+from utils.logger import get_logger
+
+__all__ = ["create_broadcast_runner"]
+
+logger = get_logger("BroadcastHandler")
+
+def create_broadcast_runner(rabbitmq):
+    """Runner of the BROADCAST jobs, with progress saved in MongoDB if configured"""
+    try:
+        mongodb = MongoDB(db_name=get_mongodb_db_name())
+    except ValueError as e:
+        logger.warning(f"{e} Broadcasts can't resume after a restart.")
+        mongodb = None
+    return BroadcastRunner.from_env(rabbitmq, mongodb=mongodb, logger=logger)
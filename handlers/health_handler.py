@@ -0,0 +1,87 @@
+import time
+
+from models.queue_monitor import QueueMonitor
+from utils.config import get_health_server_address
+from utils.health_server import HealthServer
+from utils.logger import get_logger
+
+__all__ = ["create_health_server"]
+
+logger = get_logger("HealthHandler")
+started_at = time.time()
+
+def _bots_status(bots):
+    return [
+        {
+            "logged_in": bot.is_session_valid(),
+            "breaker": bot.breaker.snapshot() if getattr(bot, "breaker", None) else None,
+            "inbound": bot.inbound.stats() if getattr(bot, "inbound", None) else None,
+            "conversations": bot.conversations.stats() if getattr(bot, "conversations", None) else None,
+        }
+        for bot in bots
+    ]
+
+def create_health_server(rabbitmq, bots, monitor: QueueMonitor):
+    """
+    Health endpoint of the service, None if HEALTH_PORT is 0.
+
+    - /healthz: liveness, the process and its consumer thread are running
+    - /readyz: readiness, broker connected and every Zalo session accepted by Zalo
+      (asked at most every SESSION_CHECK_INTERVAL seconds per bot)
+    - /metrics: queue depth, drain rate & ETA, per-tenant consumer metrics, breakers
+    - /conversations?thread_id=...[&before=...][&limit=...][&account=<bot uid>]:
+      message history of a thread, newest first, `next` is the `before` of the next page
+    """
+    host, port = get_health_server_address()
+    if not port:
+        return None
+
+    server = HealthServer(host=host, port=port, logger=logger)
+
+    def liveness(query):
+        alive = bool(rabbitmq.consumer_thread and rabbitmq.consumer_thread.is_alive())
+        return (200 if alive else 503), {"alive": alive, "uptime": round(time.time() - started_at, 1)}
+
+    def readiness(query):
+        broker_connected = rabbitmq.is_connected()
+        sessions_valid = all(bot.is_session_valid() for bot in bots)
+        ready = broker_connected and sessions_valid
+        return (200 if ready else 503), {
+            "ready": ready,
+            "broker_connected": broker_connected,
+            "zalo_sessions_valid": sessions_valid,
+        }
+
+    def metrics(query):
+        return 200, {
+            "queues": monitor.snapshot(),
+            "consumers": rabbitmq.metrics(),
+            "pending": rabbitmq.scheduler.pending(),
+            "prefetch": rabbitmq.prefetch_count,
+            "broadcasts": rabbitmq.broadcast_runner.stats() if rabbitmq.broadcast_runner else {},
+            "bots": _bots_status(bots),
+        }
+
+    def conversations(query):
+        thread_id = (query.get("thread_id") or [None])[0]
+        if not thread_id:
+            return 400, {"error": "thread_id is required"}
+        account = (query.get("account") or [None])[0]
+        stores = [
+            bot.conversations for bot in bots
+            if getattr(bot, "conversations", None) is not None
+            and (account is None or (bot.user_id is not None and str(bot.user_id) == account))
+        ]
+        if not stores:
+            return 404, {"error": "conversations are not stored"}
+        try:
+            limit = min(int((query.get("limit") or [50])[0]), 200)
+            return 200, stores[0].history(thread_id, before=(query.get("before") or [None])[0], limit=limit)
+        except ValueError as e:
+            return 400, {"error": f"invalid parameter: {e}"}
+
+    server.route("/healthz", liveness)
+    server.route("/readyz", readiness)
+    server.route("/metrics", metrics)
+    server.route("/conversations", conversations)
+    return server
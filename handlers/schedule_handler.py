@@ -0,0 +1,19 @@
+from models.mongodb import MongoDB
+from models.notification_scheduler import NotificationScheduler
+from utils.config import get_mongodb_db_name
+from utils.logger import get_logger
+
+__all__ = ["create_notification_scheduler"]
+
+logger = get_logger("ScheduleHandler")
+
+def create_notification_scheduler(rabbitmq):
+    """Scheduler of the delayed notifications, persisted in MongoDB if configured"""
+    try:
+        mongodb = MongoDB(db_name=get_mongodb_db_name())
+    except ValueError as e:
+        logger.warning(f"{e} Scheduled notifications are kept in memory only and lost on restart.")
+        mongodb = None
+    scheduler = NotificationScheduler.from_env(rabbitmq, mongodb=mongodb, logger=logger)
+    scheduler.load()
+    return scheduler
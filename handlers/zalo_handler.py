@@ -1,29 +1,109 @@
+import threading
+
 from models.zalobot import ZaloBot
-from utils.config import load_zalo_credentials
+from models.mongodb import MongoDB
+from models.friend_requests import FriendRequestTracker
+from models.conversation_store import ConversationStore
+from models.session import save_session_snapshot, load_session_snapshot, discard_session_snapshot
+from utils.config import load_zalo_credentials, get_session_snapshot_path, get_session_snapshot_ttl, get_mongodb_db_name
 from utils.logger import get_logger
 
-__all__ = ["init_zalobot", "run_zalo_listener"]
+__all__ = ["init_zalobot", "log_account_info_async"]
 
 logger = get_logger("ZaloHandler")
 
-def init_zalobot():
-    credentials = load_zalo_credentials()
+def create_friend_request_tracker(prefix_id=None):
+    """Friend request tracker persisted in MongoDB, or in memory only if MongoDB is not configured"""
+    try:
+        mongodb = MongoDB(db_name=get_mongodb_db_name())
+    except ValueError as e:
+        logger.warning(f"{e} Pending friend requests are kept in memory only.")
+        mongodb = None
+    collection = f"friend_requests_{prefix_id}" if prefix_id else "friend_requests"
+    return FriendRequestTracker(mongodb=mongodb, collection=collection, logger=logger)
+
+def create_conversation_store(prefix_id=None):
+    """Store of the inbound messages, None if MongoDB is not configured"""
+    try:
+        mongodb = MongoDB(db_name=get_mongodb_db_name())
+    except ValueError as e:
+        logger.warning(f"{e} Conversations are not saved.")
+        return None
+    collection = f"conversations_{prefix_id}" if prefix_id else "conversations"
+    return ConversationStore.from_env(mongodb, collection=collection, logger=logger)
+
+def _restore_zalobot(credentials, friend_requests, snapshot_path, conversations=None):
+    """Create a ZaloBot from the saved session snapshot, without logging in again"""
+    session = load_session_snapshot(snapshot_path, credentials["phone"], get_session_snapshot_ttl())
+    if session is None:
+        return None
+
+    bot = ZaloBot(
+        phone=credentials["phone"],
+        password=credentials["password"],
+        imei=credentials["imei"],
+        cookies=session["cookies"],
+        auto_login=False,
+        friend_requests=friend_requests,
+        conversations=conversations
+    )
+    if not bot.restore_session({**session, "imei": session.get("imei") or credentials["imei"]}):
+        logger.warning("Session snapshot is no longer valid. Falling back to full login.")
+        discard_session_snapshot(snapshot_path)
+        return None
+
+    logger.info("ZaloBot restored from session snapshot.")
+    return bot
+
+def init_zalobot(use_snapshot=True, credentials=None, prefix_id=None):
+    """
+    Create the ZaloBot of an account.
+
+    Args:
+        use_snapshot: Restore the saved session instead of logging in, when it is valid.
+        credentials: Credentials of the account (default: from .env).
+        prefix_id: Tenant owning the account, None for the shared account of the .env file.
+    """
+    credentials = credentials or load_zalo_credentials()
+    snapshot_path = get_session_snapshot_path(prefix_id)
     if credentials is None:
         logger.error("Failed to load Zalo credentials.")
         return None
-    
+
     try:
-        bot = ZaloBot(
-            phone=credentials["phone"],
-            password=credentials["password"],
-            imei=credentials["imei"],
-            cookies=credentials["cookies"]
-        )
-
-        self_id = bot.user_id
-        print(f"ZaloBot created - User")
-        bot.print_account_info(self_id)
+        friend_requests = create_friend_request_tracker(prefix_id)
+        conversations = create_conversation_store(prefix_id)
+        bot = _restore_zalobot(credentials, friend_requests, snapshot_path, conversations) if use_snapshot else None
+        if bot is None:
+            bot = ZaloBot(
+                phone=credentials["phone"],
+                password=credentials["password"],
+                imei=credentials["imei"],
+                cookies=credentials["cookies"],
+                friend_requests=friend_requests,
+                conversations=conversations
+            )
+            save_session_snapshot(snapshot_path, credentials["phone"], bot.export_session())
+
+        logger.info(f"ZaloBot created - User: {bot.user_id}")
         return bot
     except Exception as e:
         logger.error(e)
         return None
+
+def log_account_info_async(bot, delay=5.0):
+    """
+    Log the account info in the background.
+
+    It is not needed to consume messages, so it is kept out of the startup path.
+    """
+    def run():
+        try:
+            bot.print_account_info(bot.user_id)
+        except Exception as e:
+            logger.warning(f"Failed to fetch account info: {e}")
+
+    timer = threading.Timer(delay, run)
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -2,6 +2,14 @@ from abc import ABC, abstractmethod
 from zlapi._threads import ThreadType
 
 class IZaloBot(ABC):
+    """
+    Zalo account used by the handlers.
+
+    Besides these methods, an implementation exposes:
+    - `breaker`: `CircuitBreaker` of the send path
+    - `send_limiter`: `TokenBucket` every send of the account takes a token from
+    - `conversations`: `ConversationStore` of the inbound messages, or None
+    """
     @abstractmethod
     def print_account_info(self, userId):
         pass
@@ -16,4 +24,24 @@ class IZaloBot(ABC):
 
     @abstractmethod
     def send_message(self, phone_number, message, thread_type: ThreadType = ThreadType.USER):
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def send_to_uid(self, user_id, message, thread_type: ThreadType = ThreadType.USER, paced: bool = False):
+        pass
+
+    @abstractmethod
+    def resolve_uid(self, phone_number):
+        pass
+
+    @abstractmethod
+    def export_session(self):
+        pass
+
+    @abstractmethod
+    def restore_session(self, session) -> bool:
+        pass
+
+    @abstractmethod
+    def is_session_valid(self) -> bool:
+        pass
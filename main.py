@@ -4,57 +4,132 @@ import threading
 import time
 import signal
 
+from concurrent.futures import ThreadPoolExecutor
+
 from models.rabbitmq import RabbitMQ
+from models.coalescer import NotificationCoalescer
+from models.tenant import Tenant
+from models.queue_monitor import QueueMonitor
+from models.prefetch_controller import PrefetchController
 from utils.logger import setup_logger
-from handlers.zalo_handler import init_zalobot
-from handlers.bgtaskzalo_handler import TASK_REGISTRY
-from utils.config import get_prefix_id
+from utils.timing import startup_timer
+from handlers.zalo_handler import init_zalobot, log_account_info_async
+from handlers.health_handler import create_health_server
+from handlers.schedule_handler import create_notification_scheduler
+from handlers.broadcast_handler import create_broadcast_runner
+from handlers.bgtaskzalo_handler import TASK_REGISTRY, COALESCE_REGISTRY, notify_failure, get_recipient
+from utils.config import load_tenants_config, load_zalo_credentials, is_startup_timing_enabled, is_adaptive_prefetch_enabled
 
 # Setup main logger
 logger = setup_logger("Main")
 exit_flag = threading.Event()
 
-def run_zalobot():
-    bot = init_zalobot()
+def run_zalobot(bot):
     if bot is None:
         logger.error("Failed to init ZaloBot because it is None.")
         sys.exit(1)
-    
+
     # Run ZaloBot in a separate thread
     logger.info("Running ZaloBot...")
     zalo_thread = threading.Thread(target=bot.start_listener, daemon=True)
     zalo_thread.start()
-    return bot
+    return zalo_thread
 
-def run_rabbitmq(bot):
-    logger.info("Creating RabbitMQ connection...")
-    rabbitmq = RabbitMQ(bot=bot)
-    if not rabbitmq.connect():
-        sys.exit(1)
+def run_rabbitmq(rabbitmq, bot, tenants):
+    rabbitmq.set_bot(bot)
 
-    logger.info("Creating consumer...")
+    logger.info(f"Creating consumers for {len(tenants)} tenant(s)...")
     # prefetch
     # rabbitmq.channel.basic_qos(prefetch_count=1)
 
-    prefix_id = get_prefix_id()
-    consumer_created = rabbitmq.consume2(
-        queue_name=f"{prefix_id}_NOTIFY_ZALO", 
-        callback_registry=TASK_REGISTRY
+    def create_coalescer():
+        coalescer = NotificationCoalescer.from_env(COALESCE_REGISTRY, get_recipient)
+        return coalescer if coalescer.enabled else None
+
+    consumer_created = rabbitmq.consume_tenants(
+        tenants=tenants,
+        callback_registry=TASK_REGISTRY,
+        on_parked=notify_failure,
+        coalescer_factory=create_coalescer
     )
     if not consumer_created:
         sys.exit(1)
+    startup_timer.mark("consumer_started")
     return rabbitmq
 
+def start():
+    """
+    Connect to RabbitMQ and log in to every Zalo account in parallel.
+
+    Returns:
+        Tuple of (rabbitmq, bots, zalo_threads, health_server).
+    """
+    tenant_configs = load_tenants_config()
+    # The account of the .env file is only needed by tenants without their own
+    needs_default_bot = any(not config["zalo"] for config in tenant_configs)
+
+    logger.info("Creating RabbitMQ connection...")
+    rabbitmq = RabbitMQ()
+    with ThreadPoolExecutor(max_workers=len(tenant_configs) + 2, thread_name_prefix="startup") as pool:
+        broker_future = pool.submit(rabbitmq.connect)
+        default_bot_future = pool.submit(init_zalobot) if needs_default_bot else None
+        tenant_bot_futures = {
+            config["prefix_id"]: pool.submit(
+                init_zalobot,
+                credentials=load_zalo_credentials(config["zalo"]),
+                prefix_id=config["prefix_id"]
+            )
+            for config in tenant_configs if config["zalo"]
+        }
+
+        default_bot = default_bot_future.result() if default_bot_future else None
+        tenant_bots = {prefix_id: future.result() for prefix_id, future in tenant_bot_futures.items()}
+        startup_timer.mark("zalo_ready")
+        connected = broker_future.result()
+
+    if not connected:
+        sys.exit(1)
+
+    tenants = [
+        Tenant(prefix_id=config["prefix_id"], base_url=config["base_url"], bot=tenant_bots.get(config["prefix_id"]))
+        for config in tenant_configs
+    ]
+    bots = ([default_bot] if needs_default_bot else []) + list(tenant_bots.values())
+
+    # Create & run ZaLoBot
+    zalo_threads = [run_zalobot(bot) for bot in bots]
+    # Create & run RabbitMQ
+    monitor = QueueMonitor.from_env(rabbitmq)
+    monitor.register()
+    if is_adaptive_prefetch_enabled():
+        PrefetchController.from_env(rabbitmq, monitor).register()
+    # Handlers hand the notifications due later to it
+    rabbitmq.notification_scheduler = create_notification_scheduler(rabbitmq)
+    rabbitmq.broadcast_runner = create_broadcast_runner(rabbitmq)
+    run_rabbitmq(rabbitmq, default_bot, tenants)
+    rabbitmq.notification_scheduler.start()
+    rabbitmq.broadcast_runner.resume({consumer.queue_name: consumer.bot for consumer in rabbitmq.consumers})
+
+    health_server = create_health_server(rabbitmq, bots, monitor)
+    if health_server is not None:
+        health_server.start()
+
+    # Not needed to consume messages, fetch it once everything is running
+    for bot in bots:
+        log_account_info_async(bot)
+    return rabbitmq, bots, zalo_threads, health_server
+
 def main():
-    zalo_thread = None
+    zalo_threads = []
+    bots = []
+    rabbitmq = None
+    health_server = None
+    startup_timer.enabled = is_startup_timing_enabled() or "--measure-startup" in sys.argv
     try:
         signal.signal(signal.SIGINT, lambda sig, frame: exit_flag.set())
 
-        # Create & run ZaLoBot
-        bot = run_zalobot()
-        # Create & run RabbitMQ
-        rabbitmq = run_rabbitmq(bot)
-    
+        rabbitmq, bots, zalo_threads, health_server = start()
+
         # Keep main thread alive
         while not exit_flag.is_set():
             time.sleep(0.1)
@@ -63,18 +138,34 @@ def main():
         exit_flag.set()
     finally:
         # Cleanup
-        logger.info("Closing RabbitMQ connection...")
-        rabbitmq.close()
-            
-        if zalo_thread and zalo_thread.is_alive():
-            zalo_thread.join(timeout=3)
+        if health_server is not None:
+            health_server.stop()
 
+        if rabbitmq is not None and rabbitmq.notification_scheduler is not None:
+            rabbitmq.notification_scheduler.stop()
+
+        if rabbitmq is not None and rabbitmq.broadcast_runner is not None:
+            rabbitmq.broadcast_runner.stop()
+
+        if rabbitmq is not None:
+            logger.info("Closing RabbitMQ connection...")
+            rabbitmq.close()
+
+        for bot in bots:
+            # Write the buffered inbound messages before exiting
+            if bot.conversations is not None:
+                bot.conversations.stop()
+
+        for zalo_thread in zalo_threads:
             if zalo_thread.is_alive():
-                logger.warning("ZaloBot thread is still alive. Forcing exit...")
-                os._exit(0)
+                zalo_thread.join(timeout=3)
+
+        if any(zalo_thread.is_alive() for zalo_thread in zalo_threads):
+            logger.warning("ZaloBot thread is still alive. Forcing exit...")
+            os._exit(0)
 
         logger.info("Application shutdown complete.")
         return
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
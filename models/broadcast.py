@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from models.mongodb import MongoDB
+from models.retry import PermanentError, is_transient
+
+# Values a recipients query may match on, anything else (operators, sub-documents) is refused
+QUERY_VALUE_TYPES = (str, int, float, bool, type(None))
+
+class BroadcastRunner:
+    """
+    Runs BROADCAST jobs: one message sent to many recipients.
+
+    A job runs on its own thread, the message that created it is acked right away:
+    - recipients are read `batch_size` at a time, from the job itself or from
+      a MongoDB collection (range query on `_id`, so resuming doesn't rescan).
+      Only the collections of `recipient_collections` may be read, with
+      equality filters on plain values
+    - the uids of a batch are resolved by `resolve_workers` threads, through
+      the uid cache of the bot
+    - sends take a token of the bot's `send_limiter`, shared with its other
+      notifications, and go through the bot's circuit breaker, the job waits
+      while it is open
+    - progress is saved in `collection` after every recipient. `resume`
+      restarts the jobs left running, at most one recipient gets the message twice
+    - once done, a summary is published to the summary queue of the job
+    """
+    def __init__(
+            self,
+            rabbitmq,
+            mongodb: Optional[MongoDB] = None,
+            collection: str = "broadcasts",
+            recipient_collections: Iterable[str] = (),
+            batch_size: int = 50,
+            resolve_workers: int = 8,
+            max_send_attempts: int = 3,
+            logger=None
+            ):
+        self.rabbitmq = rabbitmq
+        self.mongodb = mongodb
+        self.collection = collection
+        self.recipient_collections = frozenset(recipient_collections)
+        self.batch_size = batch_size
+        self.resolve_workers = resolve_workers
+        self.max_send_attempts = max_send_attempts
+        self.logger = logger or rabbitmq.logger
+        self._running: Dict[str, threading.Thread] = {}
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, rabbitmq, mongodb: Optional[MongoDB] = None, logger=None):
+        return cls(
+            rabbitmq,
+            mongodb=mongodb,
+            recipient_collections=[
+                name.strip() for name in os.getenv("BROADCAST_RECIPIENT_COLLECTIONS", "").split(",") if name.strip()
+            ],
+            batch_size=int(os.getenv("BROADCAST_BATCH_SIZE", 50)),
+            resolve_workers=int(os.getenv("BROADCAST_RESOLVE_WORKERS", 8)),
+            logger=logger,
+        )
+
+    def submit(
+            self,
+            job_id: str,
+            bot,
+            queue: str,
+            message: str,
+            recipients: Optional[List[str]] = None,
+            source: Optional[Dict[str, Any]] = None,
+            summary_queue: Optional[str] = None
+            ) -> bool:
+        """
+        Start a broadcast of `message` to `recipients` (phone numbers), or to
+        the `source["field"]` of the documents of `source["collection"]`
+        matching `source["query"]`. A job already known by id is not started twice.
+
+        Returns:
+            True if the job was started.
+
+        Raises:
+            PermanentError: If the source is not allowed.
+        """
+        if source is not None:
+            self._check_source(source)
+
+        with self._lock:
+            if job_id in self._running:
+                self.logger.info(f"Broadcast {job_id} is already running.")
+                return False
+            job = self.mongodb.find_one(self.collection, {"_id": job_id}) if self.mongodb is not None else None
+            if job is not None and job.get("status") == "done":
+                self.logger.info(f"Broadcast {job_id} is already done.")
+                return False
+            if job is None:
+                job = {
+                    "_id": job_id,
+                    "queue": queue,
+                    "message": message,
+                    "recipients": recipients,
+                    "source": source,
+                    "summary_queue": summary_queue or f"{queue}.summary",
+                    "total": len(recipients) if recipients is not None else None,
+                    "offset": 0,
+                    "last_id": None,
+                    "sent": 0,
+                    "failed": 0,
+                    "unresolved": 0,
+                    "status": "running",
+                    "started_at": time.time(),
+                    "finished_at": None,
+                }
+                if self.mongodb is not None:
+                    self.mongodb.insert_one(self.collection, job)
+            self._start(job, bot)
+        return True
+
+    def _check_source(self, source: Dict[str, Any]):
+        """The source comes from the message, only read allowed collections with plain equality filters"""
+        if self.mongodb is None:
+            raise PermanentError("Recipients from a collection need MongoDB.")
+        if source.get("collection") not in self.recipient_collections:
+            raise PermanentError(f"Recipients collection {source.get('collection')!r} is not allowed.")
+        field = source.get("field") or "phone_number"
+        if not isinstance(field, str) or field.startswith("$"):
+            raise PermanentError(f"Invalid recipients field {field!r}.")
+        query = source.get("query") or {}
+        if not isinstance(query, dict):
+            raise PermanentError("Recipients query must be an object.")
+        for key, value in query.items():
+            if not isinstance(key, str) or key.startswith("$") or not isinstance(value, QUERY_VALUE_TYPES):
+                raise PermanentError(f"Recipients query only supports equality on plain values, got {key!r}.")
+
+    def resume(self, bots_by_queue: Dict[str, Any]) -> int:
+        """Restart the jobs left running by a previous run, with the bot of the queue they came from"""
+        if self.mongodb is None:
+            return 0
+        try:
+            jobs = self.mongodb.find(self.collection, {"status": "running"})
+        except Exception as e:
+            self.logger.warning(f"Failed to load unfinished broadcasts: {e}")
+            return 0
+
+        resumed = 0
+        with self._lock:
+            for job in jobs:
+                bot = bots_by_queue.get(job["queue"])
+                if bot is None or job["_id"] in self._running:
+                    continue
+                self.logger.info(f"Resuming broadcast {job['_id']} ({job['sent']} sent so far).")
+                self._start(job, bot)
+                resumed += 1
+        return resumed
+
+    def stop(self):
+        """Stop the jobs after their current send, they are resumed on the next start"""
+        self._stop.set()
+        with self._lock:
+            threads = list(self._running.values())
+        for thread in threads:
+            thread.join(timeout=3)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Progress of the running jobs"""
+        with self._lock:
+            return {job_id: dict(progress) for job_id, progress in self._progress.items()}
+
+    def _start(self, job, bot):
+        # Called with `_lock` held
+        thread = threading.Thread(target=self._run, args=(job, bot), name=f"broadcast-{job['_id'][:8]}", daemon=True)
+        self._running[job["_id"]] = thread
+        self._progress[job["_id"]] = self._counts(job)
+        thread.start()
+
+    @staticmethod
+    def _counts(job) -> Dict[str, Any]:
+        return {field: job[field] for field in ("total", "sent", "failed", "unresolved")}
+
+    def _run(self, job, bot):
+        job_id = job["_id"]
+        try:
+            if self._broadcast(job, bot):
+                job["status"] = "done"
+                job["finished_at"] = time.time()
+                self._save(job, "status", "finished_at")
+                self._publish_summary(job)
+                self.logger.info(
+                    f"Broadcast {job_id} done: {job['sent']} sent, {job['failed']} failed, {job['unresolved']} unresolved."
+                )
+            else:
+                self.logger.info(f"Broadcast {job_id} paused after {job['sent']} sent.")
+        except Exception as e:
+            # Left running, resumed on the next start
+            self.logger.error(f"Broadcast {job_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+                self._progress.pop(job_id, None)
+
+    def _broadcast(self, job, bot) -> bool:
+        """Send to the remaining recipients. Returns False if stopped before the end."""
+        with ThreadPoolExecutor(max_workers=self.resolve_workers, thread_name_prefix="broadcast-resolve") as pool:
+            for phones, checkpoints in self._batches(job):
+                uids = list(pool.map(lambda phone: self._resolve(bot, phone), phones))
+                for uid, checkpoint in zip(uids, checkpoints):
+                    if uid is None:
+                        job["unresolved"] += 1
+                    else:
+                        sent = self._send(bot, uid, job["message"])
+                        if sent is None:
+                            # Stopped before this recipient got it, resumed from here
+                            return False
+                        job["sent" if sent else "failed"] += 1
+
+                    job.update(checkpoint)
+                    self._save(job, "offset", "last_id", "sent", "failed", "unresolved")
+                    with self._lock:
+                        self._progress[job["_id"]] = self._counts(job)
+                    if self._stop.is_set():
+                        return False
+        return True
+
+    def _batches(self, job) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        """(phone numbers, checkpoint to save once each of them is handled)"""
+        if job["recipients"] is not None:
+            recipients = job["recipients"]
+            for start in range(job["offset"], len(recipients), self.batch_size):
+                batch = recipients[start:start + self.batch_size]
+                yield batch, [{"offset": start + i + 1} for i in range(len(batch))]
+            return
+
+        source = job["source"]
+        field = source.get("field") or "phone_number"
+        last_id = job.get("last_id")
+        while True:
+            query = dict(source.get("query") or {})
+            if last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            docs = self.mongodb.find(
+                source["collection"], query, projection={field: 1}, sort=[("_id", MongoDB.ASC)], limit=self.batch_size
+            )
+            if not docs:
+                return
+            last_id = docs[-1]["_id"]
+            yield [doc.get(field) for doc in docs], [{"last_id": doc["_id"]} for doc in docs]
+
+    def _resolve(self, bot, phone):
+        if not phone:
+            return None
+        try:
+            return bot.resolve_uid(phone)
+        except Exception as e:
+            self.logger.warning(f"Failed to resolve {phone}: {e}")
+            return None
+
+    def _send(self, bot, uid, message) -> Optional[bool]:
+        """True if sent, False if given up on, None if the runner is stopping"""
+        for attempt in range(self.max_send_attempts):
+            # Don't spend attempts while the breaker rejects every call
+            while bot.breaker.is_open():
+                if self._stop.wait(max(bot.breaker.retry_after(), 1.0)):
+                    return None
+            if not bot.send_limiter.acquire(self._stop):
+                return None
+            try:
+                bot.send_to_uid(uid, message, paced=True)
+                return True
+            except Exception as e:
+                if not is_transient(e):
+                    self.logger.warning(f"Failed to send broadcast to {uid}: {e}")
+                    return False
+                if self._stop.wait(min(2 ** attempt, 30)):
+                    return None
+        self.logger.warning(f"Gave up sending broadcast to {uid} after {self.max_send_attempts} attempts.")
+        return False
+
+    def _save(self, job, *fields):
+        if self.mongodb is None:
+            return
+        try:
+            self.mongodb.update_one(self.collection, {"_id": job["_id"]}, {"$set": {field: job[field] for field in fields}})
+        except Exception as e:
+            self.logger.warning(f"Failed to save progress of broadcast {job['_id']}: {e}")
+
+    def _publish_summary(self, job):
+        summary = {
+            "TaskId": job["_id"],
+            "ActionType": "BROADCAST_SUMMARY",
+            "Total": job["total"] if job["total"] is not None else job["sent"] + job["failed"] + job["unresolved"],
+            "Sent": job["sent"],
+            "Failed": job["failed"],
+            "Unresolved": job["unresolved"],
+            "StartedAt": job["started_at"],
+            "FinishedAt": job["finished_at"],
+        }
+        if not self.rabbitmq.publish_to_queue(json.dumps(summary), job["summary_queue"]):
+            self.logger.error(f"Failed to publish summary of broadcast {job['_id']}.")
@@ -0,0 +1,65 @@
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe cache whose entries expire `ttl` seconds after being set.
+
+    When `maxsize` is reached the least recently used entry is evicted.
+    """
+    def __init__(self, ttl: float = 600.0, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get a value, calling `loader` on a miss. Falsy values are not cached,
+        so a failed lookup is retried next time.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        if value:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self._hits, "misses": self._misses}
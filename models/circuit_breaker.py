@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+
+from collections import deque
+from typing import Callable, Dict, List
+
+from models.retry import TransientError, is_transient
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(TransientError):
+    """Raised instead of calling a service while its circuit is open"""
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker.
+
+    - CLOSED: calls go through, outcomes are kept in a sliding window of the
+      last `window_size` calls. Once at least `min_calls` are recorded and
+      the failure rate reaches `failure_rate_threshold`, the circuit opens.
+    - OPEN: calls are rejected with `CircuitOpenError` for `open_timeout`
+      seconds, then the circuit becomes HALF_OPEN.
+    - HALF_OPEN: at most `half_open_max_calls` probes run at the same time.
+      `half_open_success_threshold` successes close the circuit, a single
+      failure opens it again with a doubled timeout (up to `max_open_timeout`).
+
+    Only errors for which `is_failure` returns True count as failures, so a
+    bad payload does not open the circuit of a healthy service.
+    """
+    def __init__(
+            self,
+            name: str,
+            failure_rate_threshold: float = 0.5,
+            window_size: int = 20,
+            min_calls: int = 10,
+            open_timeout: float = 30.0,
+            max_open_timeout: float = 300.0,
+            half_open_max_calls: int = 1,
+            half_open_success_threshold: int = 3,
+            is_failure: Callable[[BaseException], bool] = is_transient,
+            logger=None
+            ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.half_open_success_threshold = half_open_success_threshold
+        self.is_failure = is_failure
+        self.logger = logger
+
+        self._lock = threading.RLock()
+        self._state = CircuitState.CLOSED
+        self._window = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._current_timeout = open_timeout
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self._open_count = 0
+        self._rejected_count = 0
+        self._listeners: List[Callable[[str, str], None]] = []
+
+    @classmethod
+    def from_env(cls, name: str, logger=None):
+        return cls(
+            name=name,
+            failure_rate_threshold=float(os.getenv("BREAKER_FAILURE_RATE", 0.5)),
+            window_size=int(os.getenv("BREAKER_WINDOW_SIZE", 20)),
+            min_calls=int(os.getenv("BREAKER_MIN_CALLS", 10)),
+            open_timeout=float(os.getenv("BREAKER_OPEN_TIMEOUT", 30.0)),
+            max_open_timeout=float(os.getenv("BREAKER_MAX_OPEN_TIMEOUT", 300.0)),
+            half_open_max_calls=int(os.getenv("BREAKER_HALF_OPEN_CALLS", 1)),
+            half_open_success_threshold=int(os.getenv("BREAKER_HALF_OPEN_SUCCESSES", 3)),
+            logger=logger,
+        )
+
+    def add_listener(self, listener: Callable[[str, str], None]):
+        """Register a `listener(old_state, new_state)` called on every transition"""
+        self._listeners.append(listener)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == CircuitState.OPEN and self.retry_after() <= 0:
+                self._transition(CircuitState.HALF_OPEN)
+            return self._state
+
+    def is_open(self) -> bool:
+        return self.state == CircuitState.OPEN
+
+    def retry_after(self) -> float:
+        """Seconds left before an open circuit lets a probe through"""
+        if self._state != CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self._current_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go through. A True answer in HALF_OPEN takes a probe slot."""
+        with self._lock:
+            state = self.state
+            if state == CircuitState.CLOSED:
+                return True
+            if state == CircuitState.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            self._rejected_count += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_success_threshold:
+                    self._transition(CircuitState.CLOSED)
+            else:
+                self._window.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                # Probe failed, back off longer before the next one
+                self._current_timeout = min(self._current_timeout * 2, self.max_open_timeout)
+                self._transition(CircuitState.OPEN)
+                return
+
+            self._window.append(False)
+            if self._state == CircuitState.CLOSED and self.failure_rate() >= self.failure_rate_threshold \
+                    and len(self._window) >= self.min_calls:
+                self._current_timeout = self.open_timeout
+                self._transition(CircuitState.OPEN)
+
+    def failure_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return self._window.count(False) / len(self._window)
+
+    def call(self, func, *args, **kwargs):
+        """Call `func` through the breaker"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open, retry in {self.retry_after():.1f}s.")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure()
+            else:
+                # The service answered, the request itself was bad
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> Dict:
+        """Current state, for monitoring"""
+        with self._lock:
+            state = self.state
+            return {
+                "name": self.name,
+                "state": state,
+                "failure_rate": round(self.failure_rate(), 3),
+                "window_calls": len(self._window),
+                "retry_after": round(self.retry_after(), 1),
+                "open_count": self._open_count,
+                "rejected_count": self._rejected_count,
+            }
+
+    def _transition(self, new_state: str):
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        if new_state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+            self._open_count += 1
+        elif new_state == CircuitState.HALF_OPEN:
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+        elif new_state == CircuitState.CLOSED:
+            self._window.clear()
+            self._current_timeout = self.open_timeout
+
+        if self.logger:
+            self.logger.warning(f"Circuit '{self.name}' {old_state} -> {new_state}")
+        for listener in self._listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Circuit listener failed: {e}")
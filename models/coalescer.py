@@ -0,0 +1,83 @@
+import os
+import threading
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (ch, method, properties, body) of a delivery waiting in a batch
+Delivery = Tuple[object, object, object, bytes]
+
+class NotificationCoalescer:
+    """
+    Buffer notifications per (recipient, action_type) during a time window.
+
+    The first delivery of a key opens a batch, every delivery of the same key
+    arriving within `window` seconds joins it. When the window ends (or the
+    batch reaches `max_batch`) the batch handler registered for the action
+    type sends one merged notification and acks every source delivery.
+
+    Action types without a batch handler (e.g. OTP) are never buffered.
+    Buffered deliveries stay unacked, so a crash before the flush simply
+    redelivers them.
+    """
+    def __init__(
+            self,
+            window: float,
+            batch_registry: Dict[str, Callable],
+            recipient_of: Callable[[bytes], str],
+            max_batch: int = 50
+            ):
+        self.window = window
+        self.batch_registry = batch_registry
+        self.recipient_of = recipient_of
+        self.max_batch = max_batch
+        self._batches: Dict[Tuple[str, str], List[Delivery]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, batch_registry: Dict[str, Callable], recipient_of: Callable[[bytes], str]):
+        return cls(
+            window=float(os.getenv("COALESCE_WINDOW", 0)),
+            batch_registry=batch_registry,
+            recipient_of=recipient_of,
+            max_batch=int(os.getenv("COALESCE_MAX_BATCH", 50)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and bool(self.batch_registry)
+
+    def accepts(self, action_type: str) -> bool:
+        return self.enabled and action_type in self.batch_registry
+
+    def add(self, action_type: str, delivery: Delivery) -> Optional[Tuple[Tuple[str, str], int]]:
+        """
+        Add a delivery to the batch of its (recipient, action_type).
+
+        Returns:
+            Tuple of (batch key, batch size). None if the recipient can't be
+            read, the delivery must then go through the regular handler.
+        """
+        try:
+            recipient = self.recipient_of(delivery[3])
+        except Exception:
+            return None
+
+        key = (recipient, action_type)
+        with self._lock:
+            batch = self._batches.setdefault(key, [])
+            batch.append(delivery)
+            return key, len(batch)
+
+    def pop(self, key: Tuple[str, str]) -> List[Delivery]:
+        with self._lock:
+            return self._batches.pop(key, [])
+
+    def handler_for(self, key: Tuple[str, str]) -> Callable:
+        return self.batch_registry[key[1]]
+
+    def clear(self) -> int:
+        """Drop every buffered delivery (their channel is gone, the broker redelivers them)"""
+        with self._lock:
+            count = sum(len(batch) for batch in self._batches.values())
+            self._batches.clear()
+            return count
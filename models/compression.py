@@ -0,0 +1,57 @@
+import gzip
+import zlib
+
+from typing import Optional, Tuple
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+SUPPORTED_ENCODINGS = (GZIP, DEFLATE)
+
+def compress_body(body: bytes, threshold: int, encoding: str = GZIP, level: int = 6) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a message body of at least `threshold` bytes.
+
+    Returns:
+        (body, content_encoding), content_encoding is None if the body was
+        left as is (too small, threshold 0, or compression didn't shrink it).
+    """
+    if threshold <= 0 or len(body) < threshold:
+        return body, None
+    if encoding == GZIP:
+        # mtime=0 keeps the output deterministic
+        compressed = gzip.compress(body, compresslevel=level, mtime=0)
+    elif encoding == DEFLATE:
+        compressed = zlib.compress(body, level)
+    else:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+def is_compressed(content_encoding: Optional[str]) -> bool:
+    """
+    True if `content_encoding` is one of the compressions of `compress_body`.
+
+    Producers also use the property for a charset ("utf-8"), those bodies are not compressed.
+    """
+    return bool(content_encoding) and content_encoding.strip().lower() in SUPPORTED_ENCODINGS
+
+def decompress_body(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    Body of a message as published, given its `content_encoding` property.
+
+    A body whose encoding is not a known compression (none, "identity", a
+    charset...) is returned as is.
+
+    Raises:
+        ValueError: If the body is corrupt.
+    """
+    if not is_compressed(content_encoding):
+        return body
+    encoding = content_encoding.strip().lower()
+    try:
+        if encoding == GZIP:
+            return gzip.decompress(body)
+        return zlib.decompress(body)
+    except (OSError, EOFError, zlib.error) as e:
+        raise ValueError(f"Corrupt {encoding} body: {e}")
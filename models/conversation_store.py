@@ -0,0 +1,209 @@
+import os
+import uuid
+import threading
+
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from models.inbound import InboundEvent
+from models.mongodb import MongoDB
+
+DUPLICATE_KEY = 11000
+
+class ConversationStore:
+    """
+    Inbound Zalo messages saved to MongoDB for the help desk.
+
+    `add` only appends to an in-memory buffer, so it is cheap enough for the
+    listener thread. A writer thread flushes the buffer with unordered
+    `insert_many` every `flush_interval` seconds, or as soon as `batch_size`
+    messages are waiting. A message is stored under its mid, so a message
+    seen twice is stored once. If MongoDB is unreachable, batches stay
+    buffered up to `max_pending` messages. Past that, new messages are
+    dropped and counted.
+
+    History is read newest first, one page at a time, with a range query on
+    the (thread_id, timestamp, _id) index rather than skip.
+    """
+    def __init__(
+            self,
+            mongodb: MongoDB,
+            collection: str = "conversations",
+            batch_size: int = 500,
+            flush_interval: float = 1.0,
+            max_pending: int = 50000,
+            logger=None
+            ):
+        self.mongodb = mongodb
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.logger = logger
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._written = 0
+        self._dropped = 0
+
+    @classmethod
+    def from_env(cls, mongodb: MongoDB, collection: str = "conversations", logger=None):
+        return cls(
+            mongodb,
+            collection=collection,
+            batch_size=int(os.getenv("CONVERSATION_BATCH_SIZE", 500)),
+            flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", 1)),
+            max_pending=int(os.getenv("CONVERSATION_MAX_PENDING", 50000)),
+            logger=logger,
+        )
+
+    def ensure_indexes(self):
+        # Serves both the thread filter and the (timestamp, _id) range of `history`
+        self.mongodb.create_index(
+            self.collection,
+            [("thread_id", MongoDB.ASC), ("timestamp", MongoDB.DESC), ("_id", MongoDB.DESC)],
+            name="thread_id_timestamp"
+        )
+
+    @staticmethod
+    def to_document(event: InboundEvent) -> Dict[str, Any]:
+        # zlapi gives the server time of the message (ms) in `ts`
+        timestamp = getattr(event.message_object, "ts", None)
+        try:
+            timestamp = int(timestamp)
+        except (TypeError, ValueError):
+            timestamp = int(event.received_at * 1000)
+        thread_type = getattr(event.thread_type, "name", event.thread_type)
+        is_text = isinstance(event.message, str)
+        return {
+            "_id": str(event.mid) if event.mid else uuid.uuid4().hex,
+            "thread_id": str(event.thread_id),
+            "thread_type": str(thread_type),
+            # Zalo message type: "webchat" (text), "chat.photo", "chat.sticker", "share.file"...
+            "type": getattr(event.message_object, "msgType", None) or ("webchat" if is_text else None),
+            "author_id": str(event.author_id),
+            "text": event.message if is_text else None,
+            # Attachment of the other types (urls, sticker id, file name...)
+            "content": None if is_text else event.message,
+            "timestamp": timestamp,
+            "received_at": event.received_at,
+        }
+
+    def add(self, event: InboundEvent) -> bool:
+        """Buffer a message (called on the listener thread, never blocks on MongoDB)"""
+        document = self.to_document(event)
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._dropped += 1
+                return False
+            self._pending.append(document)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.ensure_indexes()
+        except Exception as e:
+            self._log("warning", f"Failed to create conversation indexes: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer once the buffered messages are written"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            stopping = self._stop.is_set()
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    backoff = self.flush_interval
+                    break
+                if not self._write(batch):
+                    with self._lock:
+                        # Back at the front, in order
+                        self._pending.extendleft(reversed(batch))
+                    backoff = min(backoff * 2, 30.0)
+                    break
+            if stopping:
+                return
+
+    def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        """False if the batch must be written again later"""
+        try:
+            self.mongodb.insert_many(self.collection, batch, ordered=False)
+            written = len(batch)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            others = [error for error in errors if error.get("code") != DUPLICATE_KEY]
+            if others:
+                self._log("warning", f"Failed to save {len(others)} conversation message(s): {others[0].get('errmsg')}")
+            written = e.details.get("nInserted", 0)
+        except Exception as e:
+            self._log("warning", f"Failed to save {len(batch)} conversation message(s), will retry: {e}")
+            return False
+        with self._lock:
+            self._written += written
+        return True
+
+    def history(self, thread_id: str, before: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        """
+        Messages of a thread, newest first.
+
+        Args:
+            thread_id: Zalo thread (user or group) id.
+            before: `next` value of the previous page, None for the latest messages.
+            limit: Page size.
+
+        Returns:
+            {"messages": [...], "next": cursor of the next page or None}
+
+        Raises:
+            ValueError: If `limit` is below 1 or `before` is not a cursor.
+        """
+        if limit < 1:
+            # 0 means "no limit" to MongoDB and a negative one a single batch, both return the whole thread
+            raise ValueError(f"limit must be at least 1, got {limit}")
+        query: Dict[str, Any] = {"thread_id": str(thread_id)}
+        if before:
+            timestamp, _, last_id = before.partition(":")
+            query["$or"] = [
+                {"timestamp": {"$lt": int(timestamp)}},
+                {"timestamp": int(timestamp), "_id": {"$lt": last_id}},
+            ]
+        messages = self.mongodb.find(
+            self.collection,
+            query,
+            sort=[("timestamp", MongoDB.DESC), ("_id", MongoDB.DESC)],
+            limit=limit
+        )
+        next_cursor = None
+        if len(messages) == limit:
+            last = messages[-1]
+            next_cursor = f"{last['timestamp']}:{last['_id']}"
+        return {"messages": messages, "next": next_cursor}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"pending": len(self._pending), "written": self._written, "dropped": self._dropped}
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
@@ -0,0 +1,65 @@
+import threading
+
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+class FairScheduler:
+    """
+    Round-robin over per-tenant FIFO queues.
+
+    `get` takes one item from the tenant whose turn it is, then moves that
+    tenant to the back of the line, so a tenant with a large backlog gets
+    the same share as a tenant with a single message. Items of one tenant
+    keep their order.
+    """
+    def __init__(self):
+        self._queues: Dict[str, Deque[Any]] = {}
+        # Tenants with pending items, in turn order
+        self._turns: Deque[str] = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def put(self, tenant: str, item: Any):
+        with self._condition:
+            tenant_queue = self._queues.setdefault(tenant, deque())
+            if not tenant_queue:
+                self._turns.append(tenant)
+            tenant_queue.append(item)
+            self._size += 1
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = 0) -> Optional[Any]:
+        """
+        Next item in fair order. Waits up to `timeout` seconds (None = forever)
+        for an item, returns None if there is none.
+        """
+        with self._condition:
+            if not self._turns and timeout != 0:
+                self._condition.wait_for(lambda: bool(self._turns), timeout=timeout)
+            if not self._turns:
+                return None
+
+            tenant = self._turns.popleft()
+            tenant_queue = self._queues[tenant]
+            item = tenant_queue.popleft()
+            if tenant_queue:
+                self._turns.append(tenant)
+            self._size -= 1
+            return item
+
+    def pending(self, tenant: Optional[str] = None) -> int:
+        with self._condition:
+            if tenant is None:
+                return self._size
+            return len(self._queues.get(tenant, ()))
+
+    def clear(self) -> int:
+        with self._condition:
+            count = self._size
+            self._queues.clear()
+            self._turns.clear()
+            self._size = 0
+            return count
+
+    def __len__(self):
+        return self.pending()
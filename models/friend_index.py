@@ -0,0 +1,109 @@
+import time
+import threading
+
+from typing import Callable, Iterable, Set
+
+class FriendIndex:
+    """
+    Set of friend uids of the bot account.
+
+    Loaded from the friend list, then kept up to date by a background refresh
+    and by `add` / `discard` when a friendship change is seen. Zalo has no
+    "changed since" call, so a refresh fetches the whole list again and only
+    applies the difference with the index (entries added in the meantime are
+    kept). Membership checks are O(1) and only hit the Zalo API while the
+    index was never loaded, at most once every `retry_interval` seconds after
+    a failed load.
+    """
+    def __init__(self, fetch_friend_ids: Callable[[], Iterable], refresh_interval: float = 900.0,
+                 retry_interval: float = 60.0, logger=None):
+        self.fetch_friend_ids = fetch_friend_ids
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.logger = logger
+        self._failed_at = None
+        self._friends: Set[str] = set()
+        # Uids added while a refresh is fetching, the fetched list may predate them
+        self._added_during_fetch: Set[str] = set()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    def __len__(self):
+        return len(self._friends)
+
+    def contains(self, uid) -> bool:
+        """Check a uid, loading the index first if it has never been loaded"""
+        if not self._loaded.is_set() and not self._backing_off():
+            self.refresh(initial=True)
+        return str(uid) in self._friends
+
+    def _backing_off(self) -> bool:
+        failed_at = self._failed_at
+        return failed_at is not None and time.monotonic() - failed_at < self.retry_interval
+
+    def add(self, uid):
+        with self._lock:
+            self._friends.add(str(uid))
+            self._added_during_fetch.add(str(uid))
+
+    def discard(self, uid):
+        with self._lock:
+            self._friends.discard(str(uid))
+
+    def refresh(self, initial: bool = False) -> bool:
+        """
+        Reload the friend list and apply the difference.
+
+        `initial`: only load an index never loaded, callers that waited for
+        a concurrent load (or its failure) don't fetch the list again.
+        """
+        with self._load_lock:
+            if initial and (self._loaded.is_set() or self._backing_off()):
+                return self._loaded.is_set()
+            with self._lock:
+                self._added_during_fetch.clear()
+            try:
+                fresh = {str(uid) for uid in self.fetch_friend_ids() if uid}
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                if self.logger:
+                    self.logger.warning(f"Failed to refresh friend index: {e}")
+                return False
+            self._failed_at = None
+
+            with self._lock:
+                added = fresh - self._friends
+                removed = self._friends - fresh - self._added_during_fetch
+                self._friends |= added
+                self._friends -= removed
+                size = len(self._friends)
+            self._loaded.set()
+
+        if self.logger and (added or removed):
+            self.logger.info(f"Friend index refreshed: +{len(added)} -{len(removed)} ({size} friends)")
+        return True
+
+    def start(self):
+        """Load the index in the background and refresh it every `refresh_interval` seconds"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                # Retried sooner while the index was never loaded
+                interval = self.refresh_interval if self.refresh() or self.loaded else self.retry_interval
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="friend-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
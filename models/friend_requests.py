@@ -0,0 +1,102 @@
+import time
+import threading
+
+from typing import Any, Dict, Optional
+
+from models.mongodb import MongoDB
+
+class FriendRequestTracker:
+    """
+    Pending friend requests sent by the bot, so a user who writes several
+    times before accepting doesn't get a request per message.
+
+    Entries live in memory and, when a `MongoDB` instance is given, in the
+    `collection` collection so they survive restarts. A request is sent again
+    only after `base_interval * 2 ** (attempts - 1)` seconds (capped at
+    `max_interval`) and at most `max_attempts` times. The entry is cleared
+    once the friendship is confirmed.
+    """
+    def __init__(
+            self,
+            mongodb: Optional[MongoDB] = None,
+            collection: str = "friend_requests",
+            base_interval: float = 24 * 3600,
+            max_interval: float = 7 * 24 * 3600,
+            max_attempts: int = 3,
+            logger=None
+            ):
+        self.mongodb = mongodb
+        self.collection = collection
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.max_attempts = max_attempts
+        self.logger = logger
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Load the pending requests saved in MongoDB"""
+        if self.mongodb is None:
+            return 0
+        try:
+            docs = self.mongodb.find(self.collection, {}, projection={"sent_at": 1, "attempts": 1})
+        except Exception as e:
+            self._log("warning", f"Failed to load pending friend requests: {e}")
+            return 0
+
+        with self._lock:
+            for doc in docs:
+                self._pending[str(doc["_id"])] = {"sent_at": doc.get("sent_at", 0), "attempts": doc.get("attempts", 1)}
+            count = len(self._pending)
+        self._log("info", f"Loaded {count} pending friend request(s).")
+        return count
+
+    def should_send(self, uid) -> bool:
+        with self._lock:
+            entry = self._pending.get(str(uid))
+        if entry is None:
+            return True
+        if entry["attempts"] >= self.max_attempts:
+            return False
+        interval = min(self.base_interval * 2 ** (entry["attempts"] - 1), self.max_interval)
+        return time.time() - entry["sent_at"] >= interval
+
+    def record_sent(self, uid):
+        uid = str(uid)
+        now = time.time()
+        with self._lock:
+            entry = self._pending.setdefault(uid, {"sent_at": now, "attempts": 0})
+            entry["sent_at"] = now
+            entry["attempts"] += 1
+            attempts = entry["attempts"]
+
+        if self.mongodb is not None:
+            try:
+                self.mongodb.update_one(
+                    self.collection,
+                    {"_id": uid},
+                    {"$set": {"sent_at": now, "attempts": attempts}},
+                    upsert=True
+                )
+            except Exception as e:
+                self._log("warning", f"Failed to save friend request of {uid}: {e}")
+
+    def clear(self, uid):
+        """Forget the request of a user who is now a friend"""
+        uid = str(uid)
+        with self._lock:
+            if self._pending.pop(uid, None) is None:
+                return
+
+        if self.mongodb is not None:
+            try:
+                self.mongodb.delete_one(self.collection, {"_id": uid})
+            except Exception as e:
+                self._log("warning", f"Failed to clear friend request of {uid}: {e}")
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
@@ -0,0 +1,109 @@
+import os
+import time
+import queue
+import threading
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+class InboundEvent(NamedTuple):
+    """Lightweight copy of what the listener received, processed later by a worker"""
+    mid: Any
+    author_id: Any
+    message: Any
+    message_object: Any
+    thread_id: Any
+    thread_type: Any
+    received_at: float
+
+class InboundDispatcher:
+    """
+    Move inbound event processing off the websocket listener thread.
+
+    Events are sharded by thread id over `workers` threads, each with its own
+    bounded queue: events of one conversation are handled in order, while
+    slow conversations don't hold up the others. `submit` never blocks the
+    listener, when the shard queue is full the event is dropped and counted.
+    """
+    def __init__(self, handler: Callable[[InboundEvent], None], workers: int = 4, queue_size: int = 1000, logger=None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.logger = logger
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads: List[threading.Thread] = []
+        self._running = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._processed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._last_drop_log = 0.0
+
+    @classmethod
+    def from_env(cls, handler: Callable[[InboundEvent], None], logger=None):
+        return cls(
+            handler=handler,
+            workers=int(os.getenv("INBOUND_WORKERS", 4)),
+            queue_size=int(os.getenv("INBOUND_QUEUE_SIZE", 1000)),
+            logger=logger,
+        )
+
+    def start(self):
+        if self._running.is_set():
+            return
+        self._running.set()
+        for index, shard in enumerate(self._queues):
+            thread = threading.Thread(target=self._run_worker, args=(shard,), name=f"inbound-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 3.0):
+        self._running.clear()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads.clear()
+
+    def submit(self, event: InboundEvent) -> bool:
+        """Queue an event for its conversation worker. Returns False if it was dropped."""
+        shard = self._queues[hash(event.thread_id) % self.workers]
+        try:
+            shard.put_nowait(event)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped += 1
+                dropped = self._dropped
+                # Log at most once per second, the listener must stay fast
+                should_log = time.monotonic() - self._last_drop_log >= 1.0
+                if should_log:
+                    self._last_drop_log = time.monotonic()
+            if should_log and self.logger:
+                self.logger.warning(f"Inbound queue full, dropped event of thread {event.thread_id} ({dropped} dropped so far).")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "queued": sum(shard.qsize() for shard in self._queues),
+                "processed": self._processed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+            }
+
+    def _run_worker(self, shard: queue.Queue):
+        while self._running.is_set():
+            try:
+                event: Optional[InboundEvent] = shard.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                self.handler(event)
+                with self._stats_lock:
+                    self._processed += 1
+            except Exception as e:
+                with self._stats_lock:
+                    self._failed += 1
+                if self.logger:
+                    self.logger.error(f"Failed to process inbound message {event.mid}: {e}")
+            finally:
+                shard.task_done()
@@ -0,0 +1,34 @@
+import time
+import threading
+
+from typing import Any, Dict
+
+class ConsumerMetrics:
+    """Counters of one consumed queue (one tenant)"""
+    COUNTERS = ("received", "succeeded", "retried", "parked", "requeued", "reroute_failed", "dropped")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {counter: 0 for counter in self.COUNTERS}
+        self._handler_time = 0.0
+        self._handled = 0
+        self._last_message_at = None
+
+    def incr(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
+            if counter == "received":
+                self._last_message_at = time.time()
+
+    def observe_handler_time(self, seconds: float):
+        with self._lock:
+            self._handler_time += seconds
+            self._handled += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self._counters)
+            data["avg_handler_ms"] = round(self._handler_time / self._handled * 1000, 1) if self._handled else None
+            data["last_message_at"] = self._last_message_at
+            return data
@@ -174,19 +174,21 @@ class MongoDB(metaclass=SingletonMeta):
         result = collection.insert_one(document)
         return str(result.inserted_id)
     
-    def insert_many(self, collection_name: str, documents: List[Dict[str, Any]]) -> List[str]:
+    def insert_many(self, collection_name: str, documents: List[Dict[str, Any]], ordered: bool = True) -> List[str]:
         """
         Insert multiple documents into a collection.
         
         Args:
             collection_name: Name of the collection.
             documents: List of documents to insert.
+            ordered: If False, the server inserts the documents in any order
+                and doesn't stop at the first failing one.
             
         Returns:
             List of inserted document IDs.
         """
         collection = self.get_collection(collection_name)
-        result = collection.insert_many(documents)
+        result = collection.insert_many(documents, ordered=ordered)
         return [str(doc_id) for doc_id in result.inserted_ids]
     
     def update_one(self, collection_name: str, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> int:
@@ -267,6 +269,21 @@ class MongoDB(metaclass=SingletonMeta):
         collection = self.get_collection(collection_name)
         return collection.count_documents(query)
     
+    def create_index(self, collection_name: str, keys: List[Tuple[str, int]], **kwargs) -> str:
+        """
+        Create an index on a collection, if it doesn't exist yet.
+        
+        Args:
+            collection_name: Name of the collection.
+            keys: List of (field, direction) tuples.
+            **kwargs: Index options (name, unique, ...).
+            
+        Returns:
+            Name of the index.
+        """
+        collection = self.get_collection(collection_name)
+        return collection.create_index(keys, **kwargs)
+    
     def drop_collection(self, collection_name: str) -> None:
         """
         Drop a collection from the database.
@@ -0,0 +1,200 @@
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pika
+
+from models.mongodb import MongoDB
+from models.timer_wheel import TimerWheel
+
+# Set on the messages published by the scheduler, their handler sends them right away
+SCHEDULED_JOB_HEADER = "x-scheduled-job"
+# Wheel timer of the periodic release of stale claims, can't collide with a job id
+_RELEASE_TIMER = object()
+
+class NotificationScheduler:
+    """
+    Notifications published again to their queue at a later time.
+
+    A job is the original message body and the queue it came from, kept in a
+    `TimerWheel` and, when a `MongoDB` instance is given, in the `collection`
+    collection so pending jobs survive restarts (only the deadline is kept in
+    memory then). The wheel thread only hands due jobs to `workers` threads,
+    which claim them in MongoDB (so only one replica fires a job), republish
+    them with the `x-scheduled-job` header and delete them, so a slow claim
+    or publish never delays the next deadlines. A failed publish is retried
+    after `retry_delay` seconds. A job claimed by a replica that died is
+    released and fired again once its claim is `claim_timeout` seconds old.
+    """
+    def __init__(
+            self,
+            rabbitmq,
+            mongodb: Optional[MongoDB] = None,
+            collection: str = "scheduled_notifications",
+            tick: float = 1.0,
+            slots: int = 3600,
+            retry_delay: float = 30.0,
+            claim_timeout: float = 300.0,
+            workers: int = 4,
+            logger=None
+            ):
+        self.rabbitmq = rabbitmq
+        self.mongodb = mongodb
+        self.collection = collection
+        self.retry_delay = retry_delay
+        self.claim_timeout = claim_timeout
+        self.logger = logger or rabbitmq.logger
+        self.workers = workers
+        self.wheel = TimerWheel(self._on_due, tick=tick, slots=slots, logger=self.logger)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls, rabbitmq, mongodb: Optional[MongoDB] = None, collection: str = "scheduled_notifications", logger=None):
+        return cls(
+            rabbitmq,
+            mongodb=mongodb,
+            collection=collection,
+            tick=float(os.getenv("SCHEDULER_TICK", 1)),
+            slots=int(os.getenv("SCHEDULER_SLOTS", 3600)),
+            workers=int(os.getenv("SCHEDULER_WORKERS", 4)),
+            logger=logger,
+        )
+
+    def schedule(self, job_id: str, send_at: float, queue: str, body: bytes):
+        """Publish `body` to `queue` at `send_at` (epoch seconds). Scheduling the same job again moves it."""
+        job = {"send_at": send_at, "queue": queue, "body": body}
+        if self.mongodb is not None:
+            self.mongodb.update_one(
+                self.collection,
+                {"_id": job_id},
+                {"$set": {**job, "status": "pending"}},
+                upsert=True
+            )
+            # Fetched back when due, keeps hundreds of thousands of jobs cheap in memory
+            job = None
+        self.wheel.schedule(job_id, send_at, job)
+        self.logger.info(f"Scheduled notification {job_id} in {max(0, int(send_at - time.time()))}s.")
+
+    def cancel(self, job_id: str) -> bool:
+        cancelled = self.wheel.cancel(job_id)
+        if self.mongodb is not None:
+            cancelled = self.mongodb.delete_one(self.collection, {"_id": job_id, "status": "pending"}) > 0 or cancelled
+        self.logger.info(f"Cancelled scheduled notification {job_id}." if cancelled else f"No scheduled notification {job_id} to cancel.")
+        return cancelled
+
+    def load(self) -> int:
+        """Schedule the pending jobs saved in MongoDB"""
+        if self.mongodb is None:
+            return 0
+        try:
+            self._release_stale_claims()
+            cursor = self.mongodb.find(
+                self.collection, {"status": "pending"}, projection={"send_at": 1}, return_cursor=True
+            )
+            for doc in cursor:
+                self.wheel.schedule(doc["_id"], doc["send_at"])
+        except Exception as e:
+            self.logger.warning(f"Failed to load scheduled notifications: {e}")
+        self.logger.info(f"Loaded {len(self)} scheduled notification(s).")
+        return len(self)
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="scheduler")
+        if self.mongodb is not None:
+            self.wheel.schedule(_RELEASE_TIMER, time.time() + self.claim_timeout)
+        self.wheel.start()
+
+    def stop(self):
+        self.wheel.stop()
+        if self._executor is not None:
+            # Jobs not claimed yet stay pending in MongoDB, loaded again on the next start
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __len__(self):
+        return len(self.wheel) - (_RELEASE_TIMER in self.wheel)
+
+    def _claim(self, job_id):
+        """The job document if this replica may fire it, None if it was cancelled or fired elsewhere"""
+        return self.mongodb.get_collection(self.collection).find_one_and_update(
+            {"_id": job_id, "status": "pending"},
+            {"$set": {"status": "firing", "claimed_at": time.time()}}
+        )
+
+    def _release_stale_claims(self) -> int:
+        """Back to pending (and in the wheel) the jobs claimed more than `claim_timeout` seconds ago"""
+        stale = self.mongodb.find(
+            self.collection,
+            {"status": "firing", "claimed_at": {"$lt": time.time() - self.claim_timeout}},
+            projection={"claimed_at": 1}
+        )
+        released = 0
+        for doc in stale:
+            # Matched on claimed_at, a replica that claimed it again meanwhile keeps it
+            if self.mongodb.update_one(
+                    self.collection,
+                    {"_id": doc["_id"], "status": "firing", "claimed_at": doc["claimed_at"]},
+                    {"$set": {"status": "pending"}}
+                    ):
+                self.wheel.schedule(doc["_id"], time.time())
+                released += 1
+        if released:
+            self.logger.warning(f"Released {released} scheduled notification(s) claimed by a replica that stopped.")
+        return released
+
+    def _on_due(self, job_id, job):
+        """Runs on the timer wheel thread: hand the job to a worker and return"""
+        executor = self._executor
+        if executor is None:
+            # Stopped: left pending in MongoDB (or lost with the process)
+            return
+        task = self._run_release if job_id == _RELEASE_TIMER else self._fire
+        try:
+            executor.submit(task, job_id, job)
+        except RuntimeError:
+            # Shut down between the check and the submit
+            pass
+
+    def _run_release(self, timer_id, _):
+        try:
+            self._release_stale_claims()
+        except Exception as e:
+            self.logger.warning(f"Failed to release stale scheduled notifications: {e}")
+        finally:
+            if self._executor is not None:
+                self.wheel.schedule(timer_id, time.time() + self.claim_timeout)
+
+    def _fire(self, job_id, job):
+        """Runs on a scheduler worker"""
+        if self.mongodb is not None:
+            try:
+                job = self._claim(job_id)
+            except Exception as e:
+                self.logger.warning(f"Failed to claim scheduled notification {job_id}: {e}")
+                self.wheel.schedule(job_id, time.time() + self.retry_delay)
+                return
+            if job is None:
+                return
+
+        properties = pika.BasicProperties(delivery_mode=2, headers={SCHEDULED_JOB_HEADER: job_id})
+        if not self.rabbitmq.publish(job["body"], routing_key=job["queue"], properties=properties):
+            self.logger.warning(f"Failed to publish scheduled notification {job_id}, retrying in {self.retry_delay}s.")
+            if self.mongodb is not None:
+                try:
+                    self.mongodb.update_one(self.collection, {"_id": job_id}, {"$set": {"status": "pending"}})
+                except Exception as e:
+                    self.logger.warning(f"Failed to release scheduled notification {job_id}: {e}")
+                job = None
+            self.wheel.schedule(job_id, time.time() + self.retry_delay, job)
+            return
+
+        if self.mongodb is not None:
+            try:
+                self.mongodb.delete_one(self.collection, {"_id": job_id})
+            except Exception as e:
+                # Released after `claim_timeout`, the notification is then sent twice
+                self.logger.warning(f"Failed to delete fired notification {job_id}: {e}")
+        self.logger.info(f"Published scheduled notification {job_id} to {job['queue']}.")
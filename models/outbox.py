@@ -0,0 +1,333 @@
+import os
+import json
+import mmap
+import time
+import glob
+import zlib
+import struct
+import threading
+
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from utils.logger import get_logger
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+# Record: meta length, body length, crc32 of meta + body, then meta (JSON) and body
+RECORD_HEADER = struct.Struct("<III")
+# Index entry: offset of a record in its segment
+INDEX_ENTRY = struct.Struct("<Q")
+# Cursor: segment number, index of the next record to flush in it
+CURSOR = struct.Struct("<QQ")
+
+PROPERTY_FIELDS = (
+    "content_type", "content_encoding", "headers", "delivery_mode", "priority",
+    "correlation_id", "reply_to", "expiration", "message_id", "timestamp",
+    "type", "user_id", "app_id", "cluster_id",
+)
+
+class OutboxFullError(Exception):
+    """The outbox reached `max_bytes`"""
+
+class OutboxRecord(NamedTuple):
+    exchange: str
+    routing_key: str
+    properties: Dict[str, Any]
+    body: bytes
+
+class _Segment:
+    """Preallocated, memory-mapped segment file and its offset index"""
+    def __init__(self, directory: str, number: int, size: int):
+        self.number = number
+        self.path = os.path.join(directory, f"{number:020d}.seg")
+        self.index_path = os.path.join(directory, f"{number:020d}.idx")
+        self.size = size
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.index_file = open(self.index_path, "ab+")
+        self.offsets = self._load_index()
+        self.write_offset = self._recover()
+
+    def _load_index(self) -> List[int]:
+        self.index_file.seek(0)
+        data = self.index_file.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        if usable != len(data):
+            # Torn index entry, rebuilt by `_recover`
+            self.index_file.truncate(usable)
+        return [entry[0] for entry in INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    def _read_at(self, offset: int) -> Optional[int]:
+        """End offset of the valid record at `offset`, None if there is none"""
+        if offset + RECORD_HEADER.size > self.size:
+            return None
+        meta_len, body_len, crc = RECORD_HEADER.unpack_from(self.map, offset)
+        end = offset + RECORD_HEADER.size + meta_len + body_len
+        if meta_len == 0 or end > self.size:
+            return None
+        if zlib.crc32(self.map[offset + RECORD_HEADER.size:end]) != crc:
+            return None
+        return end
+
+    def _recover(self) -> int:
+        """Drop index entries past the last valid record and index records written after it"""
+        offset = 0
+        valid = []
+        for indexed in self.offsets:
+            end = self._read_at(indexed) if indexed == offset else None
+            if end is None:
+                break
+            valid.append(indexed)
+            offset = end
+        if len(valid) != len(self.offsets):
+            self.index_file.truncate(len(valid) * INDEX_ENTRY.size)
+        self.offsets = valid
+
+        # Records appended but not indexed before a crash
+        while True:
+            end = self._read_at(offset)
+            if end is None:
+                break
+            self._append_index(offset)
+            offset = end
+        # Clear a torn record so it can't be mistaken for a valid one later
+        if offset + RECORD_HEADER.size <= self.size:
+            self.map[offset:offset + RECORD_HEADER.size] = bytes(RECORD_HEADER.size)
+        return offset
+
+    def _append_index(self, offset: int):
+        self.index_file.seek(0, os.SEEK_END)
+        self.index_file.write(INDEX_ENTRY.pack(offset))
+        self.offsets.append(offset)
+
+    def fits(self, length: int) -> bool:
+        return self.write_offset + length <= self.size
+
+    def append(self, record: bytes):
+        offset = self.write_offset
+        self.map[offset:offset + len(record)] = record
+        self.write_offset += len(record)
+        self._append_index(offset)
+
+    def read(self, position: int):
+        """(meta + body, meta length) of the record at `position`"""
+        offset = self.offsets[position]
+        meta_len, body_len, _ = RECORD_HEADER.unpack_from(self.map, offset)
+        start = offset + RECORD_HEADER.size
+        return self.map[start:start + meta_len + body_len], meta_len
+
+    def sync(self):
+        self.map.flush()
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+
+    def close(self):
+        self.index_file.close()
+        self.map.close()
+
+    def delete(self):
+        self.close()
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class Outbox:
+    """
+    Durable FIFO of messages that could not be published yet.
+
+    Messages are appended to preallocated segment files of `segment_size`
+    bytes, memory-mapped so an append is a memory copy. Each segment has an
+    index of record offsets, and a cursor file records the next message to
+    flush. A crash at any point loses no appended message, at worst the last
+    flushed one is published again.
+
+    - `max_bytes`: cap of the segments on disk, `append` raises `OutboxFullError` past it
+    - `fsync`: "always" (sync every append), "interval" (at most every
+      `fsync_interval` seconds) or "never" (left to the OS)
+    """
+    def __init__(
+            self,
+            directory: str,
+            segment_size: int = 8 * 1024 * 1024,
+            max_bytes: int = 256 * 1024 * 1024,
+            fsync: str = FSYNC_INTERVAL,
+            fsync_interval: float = 1.0,
+            logger=None
+            ):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_bytes // segment_size)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.logger = logger or get_logger("Outbox")
+        self._lock = threading.Lock()
+        self._not_empty = threading.Event()
+        self._last_sync = time.monotonic()
+        self._dirty = False
+
+        os.makedirs(directory, exist_ok=True)
+        numbers = sorted(
+            int(os.path.basename(path)[:-len(".seg")])
+            for path in glob.glob(os.path.join(directory, "*.seg"))
+        )
+        self._cursor_map = self._open_cursor()
+        cursor_segment, cursor_position = CURSOR.unpack_from(self._cursor_map, 0)
+
+        self._segments: List[_Segment] = []
+        for number in numbers:
+            if number < cursor_segment:
+                # Fully flushed before a crash, never deleted
+                _Segment(directory, number, segment_size).delete()
+                continue
+            self._segments.append(_Segment(directory, number, segment_size))
+        if not self._segments:
+            self._segments.append(_Segment(directory, max(cursor_segment, 1), segment_size))
+        if self._segments[0].number != cursor_segment:
+            cursor_segment, cursor_position = self._segments[0].number, 0
+        self._read_position = min(cursor_position, len(self._segments[0].offsets))
+        self._write_cursor(self._segments[0].number, self._read_position)
+
+        if len(self):
+            self._not_empty.set()
+            self.logger.info(f"Outbox has {len(self)} message(s) left to publish.")
+
+    @classmethod
+    def from_env(cls, logger=None):
+        """None unless OUTBOX_DIR is set"""
+        directory = os.getenv("OUTBOX_DIR", "")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            segment_size=int(os.getenv("OUTBOX_SEGMENT_SIZE", 8 * 1024 * 1024)),
+            max_bytes=int(os.getenv("OUTBOX_MAX_BYTES", 256 * 1024 * 1024)),
+            fsync=os.getenv("OUTBOX_FSYNC", FSYNC_INTERVAL),
+            fsync_interval=float(os.getenv("OUTBOX_FSYNC_INTERVAL", 1)),
+            logger=logger,
+        )
+
+    def _open_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < CURSOR.size:
+                os.ftruncate(fd, CURSOR.size)
+            return mmap.mmap(fd, CURSOR.size)
+        finally:
+            os.close(fd)
+
+    def _write_cursor(self, segment: int, position: int):
+        CURSOR.pack_into(self._cursor_map, 0, segment, position)
+
+    @staticmethod
+    def _encode(exchange, routing_key, properties, body) -> bytes:
+        meta = json.dumps({
+            "exchange": exchange,
+            "routing_key": routing_key,
+            "properties": {
+                field: getattr(properties, field)
+                for field in PROPERTY_FIELDS
+                if properties is not None and getattr(properties, field, None) is not None
+            },
+        }, default=str).encode("utf-8")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return RECORD_HEADER.pack(len(meta), len(body), zlib.crc32(meta + body)) + meta + body
+
+    def append(self, exchange: str, routing_key: str, properties, body):
+        """Queue a message behind the ones already in the outbox"""
+        record = self._encode(exchange, routing_key, properties, body)
+        if len(record) > self.segment_size:
+            raise OutboxFullError(f"Message of {len(record)} bytes exceeds the outbox segment size.")
+
+        with self._lock:
+            tail = self._segments[-1]
+            if not tail.fits(len(record)):
+                if len(self._segments) >= self.max_segments:
+                    raise OutboxFullError(f"Outbox is full ({len(self)} messages).")
+                tail = _Segment(self.directory, tail.number + 1, self.segment_size)
+                self._segments.append(tail)
+            tail.append(record)
+            self._dirty = True
+            self._maybe_sync()
+        self._not_empty.set()
+
+    def peek(self) -> Optional[OutboxRecord]:
+        """Oldest message not flushed yet, None if the outbox is empty"""
+        with self._lock:
+            segment = self._advance()
+            if segment is None:
+                return None
+            data, meta_len = segment.read(self._read_position)
+        meta = json.loads(data[:meta_len])
+        return OutboxRecord(meta["exchange"], meta["routing_key"], meta["properties"], data[meta_len:])
+
+    def commit(self):
+        """Mark the message returned by `peek` as published"""
+        with self._lock:
+            self._read_position += 1
+            self._write_cursor(self._segments[0].number, self._read_position)
+            self._dirty = True
+            self._advance()
+            self._maybe_sync()
+            if not len(self):
+                self._not_empty.clear()
+
+    def _advance(self) -> Optional[_Segment]:
+        """Drop flushed segments, return the segment holding the next message"""
+        while True:
+            head = self._segments[0]
+            if self._read_position < len(head.offsets):
+                return head
+            if len(self._segments) == 1:
+                return None
+            self._segments.pop(0).delete()
+            self._read_position = 0
+            self._write_cursor(self._segments[0].number, 0)
+
+    def _maybe_sync(self):
+        if self.fsync == FSYNC_ALWAYS or (
+            self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self._sync()
+
+    def _sync(self):
+        for segment in self._segments:
+            segment.sync()
+        self._cursor_map.flush()
+        self._last_sync = time.monotonic()
+        self._dirty = False
+
+    def sync(self):
+        """Flush pending writes to disk (called periodically under the "interval" policy)"""
+        with self._lock:
+            if self._dirty and self.fsync != FSYNC_NEVER:
+                self._sync()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until the outbox holds a message"""
+        return self._not_empty.wait(timeout)
+
+    def __len__(self):
+        pending = sum(len(segment.offsets) for segment in self._segments)
+        return pending - self._read_position
+
+    def close(self):
+        with self._lock:
+            if self.fsync != FSYNC_NEVER:
+                self._sync()
+            for segment in self._segments:
+                segment.close()
+            self._cursor_map.close()
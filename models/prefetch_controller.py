@@ -0,0 +1,141 @@
+import os
+import math
+import threading
+
+from models.circuit_breaker import CircuitState
+
+class PrefetchController:
+    """
+    Adjust the `basic_qos` prefetch of the consumers from the observed handler latency.
+
+    Every `interval` seconds, from the deliveries handled during the interval:
+    - S: mean handler service time
+    - U: worker utilisation, busy time / (workers * interval)
+    - Wq: mean time a delivery waited locally before a worker picked it up
+
+    Little's law gives the number of messages that must be in flight to keep
+    every worker busy: L = workers * (1 + rtt / S), `rtt` being the time the
+    broker takes to send a replacement message. The prefetch moves towards
+    L with AIMD damping:
+    - deliveries wait locally longer than a service time (Wq > S): this replica
+      is hoarding, the prefetch is cut by `decrease_factor`
+    - workers are under-used, nothing waits locally and the broker has a
+      backlog (from the `QueueMonitor`, if given): +`increase_step`
+    - otherwise: one `increase_step` towards L
+    The total is split across the consumers and kept within [min_prefetch, max_prefetch].
+    """
+    def __init__(
+            self,
+            rabbitmq,
+            monitor=None,
+            interval: float = 10.0,
+            min_prefetch: int = 1,
+            max_prefetch: int = 100,
+            rtt: float = 0.05,
+            increase_step: int = 1,
+            decrease_factor: float = 0.5,
+            low_utilisation: float = 0.7
+            ):
+        self.rabbitmq = rabbitmq
+        self.monitor = monitor
+        self.interval = interval
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.rtt = rtt
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.low_utilisation = low_utilisation
+        self.logger = rabbitmq.logger
+        self.prefetch = max(min_prefetch, min(rabbitmq.prefetch_count or min_prefetch, max_prefetch))
+        self._lock = threading.Lock()
+        self._reset()
+
+    @classmethod
+    def from_env(cls, rabbitmq, monitor=None):
+        return cls(
+            rabbitmq,
+            monitor=monitor,
+            interval=float(os.getenv("PREFETCH_INTERVAL", 10)),
+            min_prefetch=int(os.getenv("PREFETCH_MIN", 1)),
+            max_prefetch=int(os.getenv("PREFETCH_MAX", 100)),
+            rtt=float(os.getenv("PREFETCH_RTT", 0.05)),
+        )
+
+    def register(self):
+        """Attach to `rabbitmq`: workers report to it, adjustments run on the I/O thread"""
+        self.rabbitmq.prefetch_count = self.prefetch
+        self.rabbitmq.prefetch_controller = self
+        self.rabbitmq.add_periodic_task(self.interval, self.adjust)
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self._wait_time += seconds
+            self._waits += 1
+
+    def observe_service(self, seconds: float):
+        with self._lock:
+            self._busy_time += seconds
+            self._completed += 1
+
+    def _has_backlog(self):
+        if self.monitor is None:
+            return False
+        return any(sample.get("message_count") for sample in self.monitor.snapshot().values())
+
+    def _reset(self):
+        self._wait_time = 0.0
+        self._waits = 0
+        self._busy_time = 0.0
+        self._completed = 0
+
+    def adjust(self):
+        """Runs on the I/O thread"""
+        with self._lock:
+            busy_time, completed = self._busy_time, self._completed
+            wait_time, waits = self._wait_time, self._waits
+            self._reset()
+
+        consumers = self.rabbitmq.consumers
+        if not completed or not consumers:
+            return
+
+        workers = max(1, self.rabbitmq.handler_workers)
+        service_time = busy_time / completed
+        utilisation = busy_time / (workers * self.interval)
+        local_wait = wait_time / waits if waits else 0.0
+        target = math.ceil(workers * (1 + self.rtt / max(service_time, 1e-3)))
+
+        # Prefetch applies per channel, the target is for the whole process
+        current_total = self.prefetch * len(consumers)
+        if local_wait > service_time:
+            new_total = math.floor(current_total * self.decrease_factor)
+            reason = f"hoarding (wait {local_wait * 1000:.0f}ms > service {service_time * 1000:.0f}ms)"
+        elif utilisation < self.low_utilisation and self.rabbitmq.scheduler.pending() == 0 and self._has_backlog():
+            new_total = current_total + self.increase_step * len(consumers)
+            reason = f"workers idle ({utilisation:.0%} busy)"
+        elif target > current_total:
+            new_total = current_total + self.increase_step * len(consumers)
+            reason = f"below target {target}"
+        elif target < current_total:
+            new_total = current_total - self.increase_step * len(consumers)
+            reason = f"above target {target}"
+        else:
+            return
+
+        prefetch = max(self.min_prefetch, min(self.max_prefetch, math.ceil(new_total / len(consumers))))
+        if prefetch == self.prefetch:
+            return
+
+        self.logger.info(
+            f"Prefetch {self.prefetch} -> {prefetch}: {reason} "
+            f"(S={service_time * 1000:.0f}ms, U={utilisation:.0%}, Wq={local_wait * 1000:.0f}ms, L={target})"
+        )
+        self.prefetch = prefetch
+        self.rabbitmq.prefetch_count = prefetch
+        for consumer in consumers:
+            # Paused / probing consumers get the new value when their circuit closes
+            if consumer.circuit_breaker is None or consumer.circuit_breaker.state == CircuitState.CLOSED:
+                try:
+                    consumer.channel.basic_qos(prefetch_count=prefetch)
+                except Exception as e:
+                    self.logger.error(f"Failed to set prefetch of {consumer.queue_name}: {e}")
@@ -0,0 +1,253 @@
+import copy
+import time
+import functools
+
+from typing import Callable, Dict, Optional
+
+from models.retry import RetryPolicy, RetryRouter, PermanentError, is_transient
+from models.circuit_breaker import CircuitBreaker, CircuitState
+from models.coalescer import NotificationCoalescer
+from models.compression import decompress_body, is_compressed
+from models.metrics import ConsumerMetrics
+from models.tenant import Tenant
+from models.threadsafe_channel import ThreadSafeChannel
+from utils.timing import startup_timer
+
+class QueueConsumer:
+    """
+    Consumer of one tenant queue, on its own channel of the shared connection.
+
+    Deliveries are not handled in the pika callback: they are put in the
+    fair scheduler of the `RabbitMQ` instance, whose handler workers call
+    `process` in round-robin order across tenants. Handlers get a
+    `ThreadSafeChannel`, the channel itself is only used on the I/O thread.
+    """
+    def __init__(
+            self,
+            rabbitmq,
+            tenant: Tenant,
+            callback_registry: Dict[str, Callable],
+            auto_ack: bool = False,
+            retry_policy: Optional[RetryPolicy] = None,
+            on_parked: Optional[Callable] = None,
+            circuit_breaker: Optional[CircuitBreaker] = None,
+            coalescer: Optional[NotificationCoalescer] = None,
+            queue_name: Optional[str] = None
+            ):
+        self.rabbitmq = rabbitmq
+        self.tenant = tenant
+        self.queue_name = queue_name or tenant.queue_name
+        self.callback_registry = callback_registry
+        self.auto_ack = auto_ack
+        self.on_parked = on_parked
+        self.circuit_breaker = circuit_breaker
+        self.coalescer = coalescer
+        self.logger = rabbitmq.logger
+        self.retry_router = RetryRouter(
+            self.queue_name, retry_policy or RetryPolicy.from_env(), compress=rabbitmq.compress, logger=self.logger
+        )
+        self.metrics = ConsumerMetrics(tenant.prefix_id)
+        self.channel = None
+        self.safe_channel = None
+        self.consumer_tag = None
+
+        if circuit_breaker is not None:
+            circuit_breaker.add_listener(self._on_circuit_change)
+
+    @property
+    def bot(self):
+        return self.tenant.bot or self.rabbitmq.zalo_bot
+
+    @property
+    def connection(self):
+        return self.rabbitmq.connection
+
+    def setup(self):
+        """Open the channel, declare the queues and start consuming (unless the circuit is open)"""
+        self.channel = self.connection.channel()
+        self.safe_channel = ThreadSafeChannel(self.channel, self.connection, logger=self.logger)
+        self.consumer_tag = None
+        self.channel.queue_declare(queue=self.queue_name, durable=True)   # use existing or create
+        self.retry_router.declare(self.channel)
+
+        if self.coalescer is not None:
+            dropped = self.coalescer.clear()
+            if dropped:
+                self.logger.warning(f"Dropped {dropped} buffered message(s) of {self.queue_name}, the broker will redeliver them.")
+
+        state = self.circuit_breaker.state if self.circuit_breaker is not None else CircuitState.CLOSED
+        self._apply_circuit_state(state)
+        self.logger.info(f"Consumer started for queue: {self.queue_name}")
+
+    def _start(self):
+        if self.consumer_tag is None:
+            self.consumer_tag = self.channel.basic_consume(
+                queue=self.queue_name,
+                on_message_callback=self._on_delivery,
+                auto_ack=self.auto_ack
+            )
+
+    def _pause(self):
+        if self.consumer_tag is not None:
+            self.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+        retry_after = self.circuit_breaker.retry_after()
+        self.logger.warning(f"Paused consuming {self.queue_name}, probing again in {retry_after:.1f}s.")
+        self.connection.call_later(max(retry_after, 0.1), self._probe_circuit)
+
+    def _probe_circuit(self):
+        # Reading the state moves an expired OPEN circuit to HALF_OPEN
+        if self.circuit_breaker.state == CircuitState.OPEN:
+            self.connection.call_later(max(self.circuit_breaker.retry_after(), 0.1), self._probe_circuit)
+
+    def _apply_circuit_state(self, state):
+        """Runs on the connection thread, the only one allowed to use the channel"""
+        try:
+            if state == CircuitState.OPEN:
+                self._pause()
+            elif state == CircuitState.HALF_OPEN:
+                self.channel.basic_qos(prefetch_count=self.circuit_breaker.half_open_max_calls)
+                self._start()
+                self.logger.info(f"Probing {self.queue_name} with {self.circuit_breaker.half_open_max_calls} message(s).")
+            else:
+                self.channel.basic_qos(prefetch_count=self.rabbitmq.prefetch_count)
+                self._start()
+        except Exception as e:
+            # The channel is gone, `setup` applies the state after reconnect
+            self.logger.error(f"Failed to apply circuit state {state} to {self.queue_name}: {e}")
+
+    def _on_circuit_change(self, old_state, new_state):
+        # May be called from any thread sending through the breaker
+        try:
+            self.connection.add_callback_threadsafe(functools.partial(self._apply_circuit_state, new_state))
+        except Exception as e:
+            self.logger.error(f"Failed to apply circuit state {new_state}: {e}")
+
+    def _on_delivery(self, ch, method, properties, body):
+        startup_timer.mark("first_message")
+        self.metrics.incr("received")
+        # The delivery tag only means something on the channel it came from, `setup` replaces it on reconnect
+        self.rabbitmq.scheduler.put(
+            self.tenant.prefix_id,
+            functools.partial(self._process_scheduled, self.safe_channel, time.monotonic(), method, properties, body)
+        )
+
+    def _process_scheduled(self, ch, received_at, method, properties, body):
+        controller = self.rabbitmq.prefetch_controller
+        if controller is not None:
+            # Time spent in the local buffer, grows when this process prefetches more than it can handle
+            controller.observe_wait(time.monotonic() - received_at)
+        if not ch.is_open:
+            # The broker requeued it when the channel closed, acking it on another channel would close that one too
+            self.metrics.incr("dropped")
+            return
+        self.process(ch, method, properties, body)
+
+    def process(self, ch, method, properties, body):
+        """Xử lý message và gọi callback tương ứng (on a handler worker)"""
+        if self.circuit_breaker is not None and self.circuit_breaker.is_open():
+            # Delivered before the consumer was cancelled, give it back untouched
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            self.metrics.incr("requeued")
+            return
+
+        # Other encodings (e.g. a charset set by the producer) are left to the handlers
+        if properties is not None and is_compressed(properties.content_encoding):
+            try:
+                body = decompress_body(body, properties.content_encoding)
+            except ValueError as e:
+                self.logger.error(f"Invalid message encoding: {e}")
+                # Parked as received
+                self.handle_failure(ch, method, properties, body, PermanentError(str(e)))
+                return
+            # Handlers, retries and the parking queue see the plain body from here on
+            properties = copy.copy(properties)
+            properties.content_encoding = None
+
+        try:
+            message = body.decode('utf-8')
+            # Payload format: <_>|<actioType>|<taskId>#<payload>
+            data_fragment = message.split("|")
+            action_type = data_fragment[1]
+        except (UnicodeDecodeError, IndexError) as e:
+            self.logger.error(f"Invalid message format: {e}")
+            self.handle_failure(ch, method, properties, body, PermanentError(f"Invalid message format: {e}"))
+            return
+
+        callback = self.callback_registry.get(action_type)
+        if not callback:
+            self.logger.warning(f"No handler found for action_type: {action_type}")
+            self.handle_failure(ch, method, properties, body, PermanentError(f"No handler for action_type: {action_type}"))
+            return
+
+        if self.coalescer is not None and self.coalescer.accepts(action_type):
+            added = self.coalescer.add(action_type, (ch, method, properties, body))
+            if added is not None:
+                key, size = added
+                if size == 1:
+                    self.rabbitmq.call_later_threadsafe(self.coalescer.window, functools.partial(self._schedule_flush, key))
+                elif size >= self.coalescer.max_batch:
+                    self.flush_batch(key)
+                return
+
+        self.dispatch(callback, action_type, ch, method, properties, body)
+
+    def handler_kwargs(self):
+        return {
+            "bot": self.bot,
+            "logger": self.logger,
+            "base_url": self.tenant.base_url,
+            "queue_name": self.queue_name,
+            "scheduler": self.rabbitmq.notification_scheduler,
+            "broadcasts": self.rabbitmq.broadcast_runner,
+        }
+
+    def dispatch(self, callback, action_type, ch, method, properties, body):
+        started = time.perf_counter()
+        try:
+            # Truyền thêm logger vào callback
+            callback(ch, method, properties, body, **self.handler_kwargs())
+            self.metrics.incr("succeeded")
+        except Exception as e:
+            self.logger.error(f"[{self.tenant.prefix_id}] Failed to handle {action_type} message: {e}")
+            self.handle_failure(ch, method, properties, body, e)
+        finally:
+            self.metrics.observe_handler_time(time.perf_counter() - started)
+
+    def _schedule_flush(self, key):
+        # Timer fired on the I/O thread, the flush itself runs on a handler worker
+        self.rabbitmq.scheduler.put(self.tenant.prefix_id, functools.partial(self.flush_batch, key))
+
+    def flush_batch(self, key):
+        deliveries = self.coalescer.pop(key)
+        if not deliveries:
+            return
+
+        action_type = key[1]
+        started = time.perf_counter()
+        try:
+            self.coalescer.handler_for(key)(deliveries, **self.handler_kwargs())
+            self.metrics.incr("succeeded", len(deliveries))
+        except Exception as e:
+            if is_transient(e):
+                self.logger.error(f"Failed to send {len(deliveries)} coalesced {action_type} messages: {e}")
+                for delivery in deliveries:
+                    self.handle_failure(*delivery, e)
+            else:
+                # One bad message must not fail the whole batch, handle them one by one
+                self.logger.warning(f"Coalesced {action_type} batch failed ({e}), handling messages one by one.")
+                for delivery in deliveries:
+                    self.dispatch(self.callback_registry[action_type], action_type, *delivery)
+        finally:
+            self.metrics.observe_handler_time(time.perf_counter() - started)
+
+    def handle_failure(self, ch, method, properties, body, error):
+        outcome = self.retry_router.handle_failure(ch, method, properties, body, error)
+        if outcome is None:
+            self.metrics.incr("reroute_failed")
+            return
+
+        self.metrics.incr("retried" if outcome == "retry" else "parked")
+        if outcome == "parked" and self.on_parked:
+            # Best effort, must not hold up the consumer
+            self.rabbitmq.run_in_background(self.on_parked, body, **self.handler_kwargs())
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+
+from typing import Any, Dict, Optional
+
+import pika.exceptions
+
+class QueueMonitor:
+    """
+    Backlog of the consumed queues, sampled on the I/O thread.
+
+    Every `interval` seconds each queue is declared passively on a side
+    channel to read its `message_count` and `consumer_count`. From two
+    samples it derives:
+    - `consume_rate`: messages/s received by this process (from the consumer metrics)
+    - `drain_rate`: messages/s the backlog shrinks by (negative when it grows),
+      smoothed with an EWMA
+    - `eta_seconds`: estimated time until the queue is empty, None if it
+      isn't draining
+    """
+    def __init__(self, rabbitmq, interval: float = 15.0, smoothing: float = 0.3):
+        self.rabbitmq = rabbitmq
+        self.interval = interval
+        self.smoothing = smoothing
+        self.logger = rabbitmq.logger
+        self._side_channel = None
+        self._samples: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, rabbitmq):
+        return cls(rabbitmq, interval=float(os.getenv("QUEUE_MONITOR_INTERVAL", 15)))
+
+    def register(self):
+        """Schedule the sampling on the I/O thread of `rabbitmq`"""
+        self.rabbitmq.add_periodic_task(self.interval, self.sample)
+
+    def _channel(self):
+        connection = self.rabbitmq.connection
+        if self._side_channel is None or not self._side_channel.is_open or self._side_channel.connection is not connection:
+            self._side_channel = connection.channel()
+        return self._side_channel
+
+    def sample(self):
+        """Runs on the I/O thread"""
+        for consumer in self.rabbitmq.consumers:
+            try:
+                result = self._channel().queue_declare(queue=consumer.queue_name, passive=True)
+            except pika.exceptions.ChannelClosedByBroker as e:
+                # Passive declare of a missing queue closes the channel, it's reopened next time
+                self.logger.warning(f"Failed to read depth of {consumer.queue_name}: {e}")
+                continue
+            self._update(
+                consumer.tenant.prefix_id,
+                consumer.queue_name,
+                result.method.message_count,
+                result.method.consumer_count,
+                consumer.metrics.snapshot()["received"]
+            )
+
+    def _update(self, prefix_id, queue_name, message_count, consumer_count, received):
+        now = time.monotonic()
+        with self._lock:
+            previous = self._samples.get(prefix_id)
+            sample = {
+                "queue": queue_name,
+                "message_count": message_count,
+                "consumer_count": consumer_count,
+                "consume_rate": None,
+                "drain_rate": None,
+                "eta_seconds": None,
+                "sampled_at": time.time(),
+                "_monotonic": now,
+                "_received": received,
+            }
+            if previous is not None and now > previous["_monotonic"]:
+                elapsed = now - previous["_monotonic"]
+                sample["consume_rate"] = round((received - previous["_received"]) / elapsed, 3)
+                drain_rate = (previous["message_count"] - message_count) / elapsed
+                if previous["drain_rate"] is not None:
+                    drain_rate = self.smoothing * drain_rate + (1 - self.smoothing) * previous["drain_rate"]
+                sample["drain_rate"] = round(drain_rate, 3)
+                if message_count == 0:
+                    sample["eta_seconds"] = 0
+                elif drain_rate > 0:
+                    sample["eta_seconds"] = round(message_count / drain_rate, 1)
+            self._samples[prefix_id] = sample
+
+    def snapshot(self, prefix_id: Optional[str] = None) -> Dict[str, Any]:
+        """Last sample of each tenant queue (public fields only)"""
+        with self._lock:
+            samples = {
+                key: {field: value for field, value in sample.items() if not field.startswith("_")}
+                for key, sample in self._samples.items()
+            }
+        if prefix_id is not None:
+            return samples.get(prefix_id, {})
+        return samples
@@ -2,14 +2,27 @@ import pika
 import os
 import time
 import threading
+import copy
+import functools
 import pika.exceptions
 import pika.spec
 
 from interfaces import IZaloBot
+from typing import Callable, List
+
+from models.retry import RetryPolicy
+from models.circuit_breaker import CircuitBreaker
+from models.coalescer import NotificationCoalescer
+from models.fair_scheduler import FairScheduler
+from models.queue_consumer import QueueConsumer
+from models.tenant import Tenant
+from models.outbox import Outbox, OutboxFullError
+from models.compression import compress_body
 from utils.logger import setup_logger
+from utils.timing import startup_timer
 
 class RabbitMQ:
-    def __init__(self, bot: IZaloBot = None):
+    def __init__(self, bot: IZaloBot = None, use_outbox: bool = True):
         self.user = os.getenv('RABBITMQ_USER', 'guest')
         self.password = os.getenv('RABBITMQ_PASSWORD', 'guest')
         self.host = os.getenv('RABBITMQ_HOST', 'localhost')
@@ -20,16 +33,69 @@ class RabbitMQ:
         self.consumer_thread = None
         self.is_consuming = False
         self.zalo_bot = bot
+        # 0 = no limit
+        self.prefetch_count = int(os.getenv('RABBITMQ_PREFETCH', 0))
+        # Used instead of "no limit" when a circuit breaker may pause the consumers
+        self.breaker_prefetch_count = int(os.getenv('RABBITMQ_BREAKER_PREFETCH', 50))
+        self.circuit_breaker: CircuitBreaker|None = None
+        self.consumers: List[QueueConsumer] = []
+        # Deliveries of all consumed queues, handled in round-robin order across tenants
+        self.scheduler = FairScheduler()
+        self.metrics_interval = float(os.getenv('METRICS_LOG_INTERVAL', 60))
+        self.heartbeat = int(os.getenv('RABBITMQ_HEARTBEAT', 60))
+        self.blocked_connection_timeout = float(os.getenv('RABBITMQ_BLOCKED_TIMEOUT', 300))
+        # Handlers run on these threads, the consumer (I/O) thread only services the connection
+        self.handler_workers = int(os.getenv('HANDLER_WORKERS', 4))
+        self.worker_threads: List[threading.Thread] = []
+        # Holds the notifications to send later, passed to the handlers
+        self.notification_scheduler = None
+        # Runs the BROADCAST jobs, passed to the handlers
+        self.broadcast_runner = None
+        # Set by `PrefetchController.register`, fed by the handler workers
+        self.prefetch_controller = None
+        self._io_thread_ident = None
+        # Messages published while the broker is unreachable, None if OUTBOX_DIR isn't set.
+        # Opening an outbox writes to it, a process that doesn't own it (e.g. a tool) passes use_outbox=False
+        self.outbox = Outbox.from_env(logger=self.logger) if use_outbox else None
+        self.publish_timeout = float(os.getenv('RABBITMQ_PUBLISH_TIMEOUT', 5))
+        # Bodies of at least this many bytes are published compressed, 0 = never
+        self.compress_threshold = int(os.getenv('RABBITMQ_COMPRESS_THRESHOLD', 0))
+        self.compress_encoding = os.getenv('RABBITMQ_COMPRESS_ENCODING', 'gzip')
+        # Level 1 saves nearly as much as 6 on these JSON bodies at half the CPU (benchmarks/bench_compression.py)
+        self.compress_level = int(os.getenv('RABBITMQ_COMPRESS_LEVEL', 1))
+        # A message the broker refused this many times in a row is moved to `outbox_parking_queue`
+        self.outbox_max_attempts = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+        self.outbox_parking_queue = os.getenv('OUTBOX_PARKING_QUEUE', 'outbox.parking')
+        self.outbox_thread = None
+        self._outbox_stop = threading.Event()
+        self._publish_lock = threading.Lock()
+        # (interval, func) run on the I/O thread, rescheduled after every reconnect
+        self.periodic_tasks = [(self.metrics_interval, self._log_metrics)]
+
+    def set_bot(self, bot: IZaloBot):
+        """Attach the ZaloBot once it is ready (the broker may connect first)"""
+        self.zalo_bot = bot
 
     def connect(self, retries=5, delay=2):
         for i in range(retries):
             try:
                 credentials = pika.PlainCredentials(self.user, self.password)
-                parameters = pika.ConnectionParameters(host=self.host, port=self.port, credentials=credentials)
+                parameters = pika.ConnectionParameters(
+                    host=self.host,
+                    port=self.port,
+                    credentials=credentials,
+                    heartbeat=self.heartbeat,
+                    blocked_connection_timeout=self.blocked_connection_timeout
+                )
                 self.connection = pika.BlockingConnection(parameters)
                 self.channel = self.connection.channel()
+                if self.outbox is not None:
+                    # A message leaves the outbox only once the broker confirmed it
+                    self.channel.confirm_delivery()
+                    self._start_outbox_flusher()
                 self.logger.info("============================================================================")
                 self.logger.info("Connected to RabbitMQ")
+                startup_timer.mark("broker_connected")
                 return True
             except Exception as e:
                 self.logger.warning(f"Failed to connect to RabbitMQ, retrying in {delay} seconds... ({i+1}/{retries})")
@@ -41,19 +107,29 @@ class RabbitMQ:
     def close(self):
         self.is_consuming = False
         try:
-            # Stop consuming
-            if self.channel and self.channel.is_open:
+            if self.outbox_thread and self.outbox_thread.is_alive():
+                self._outbox_stop.set()
+                self.outbox_thread.join(timeout=3)
+            # Stop consuming (the I/O thread of `start_consumers` stops on its own)
+            if not self.consumers and self.channel and self.channel.is_open:
                 self.channel.stop_consuming()
             
             if self.consumer_thread and self.consumer_thread.is_alive():
                 self.consumer_thread.join(timeout=3)
                 self.logger.info("Consumer thread stopped")
 
+            for worker in self.worker_threads:
+                worker.join(timeout=3)
+            self.worker_threads.clear()
+
             if self.connection and not self.connection.is_closed:
                 self.connection.close()
                 self.logger.info("RabbitMQ connection closed.")
         except Exception as e:
             self.logger.error(f"Failed to close RabbitMQ connection: {e}")
+        finally:
+            if self.outbox is not None:
+                self.outbox.close()
 
     def declare_exchange(self, exchange_name, exchange_type='direct', passive=False, durable=True, auto_delete=False):
         """
@@ -196,84 +272,228 @@ class RabbitMQ:
             self.logger.error(f"Failed to setup consumer: {e}")
             return False
     
-    def consume2(self, queue_name, callback_registry, auto_ack=False):
+    def consume2(self, queue_name, callback_registry, auto_ack=False, retry_policy: RetryPolicy|None = None, on_parked=None,
+                 circuit_breaker: CircuitBreaker|None = None, coalescer: NotificationCoalescer|None = None):
         """
         Consume messages from a queue
 
         Parameters:
         - queue_name: Name of the queue
-        - callback: Callback function to handle received messages
+        - callback_registry: Mapping of action_type to the callback handling it
+        - auto_ack: Whether to automatically acknowledge received messages
+        - retry_policy: Backoff policy of failed messages (default: from env)
+        - on_parked: Called with (body, bot=, logger=) when a message is parked for good
+        - circuit_breaker: Breaker of the Zalo send path. While it is open the consumer is
+          cancelled (a prefetch of 0 means "unlimited" in AMQP, so it cannot be used to pause),
+          in half-open state only `half_open_max_calls` messages are prefetched as probes.
+        - coalescer: Merges notifications of the same (recipient, action_type) received within
+          its window into one message. Buffered deliveries count against the prefetch.
+        """
+        prefix_id = queue_name.removesuffix("_NOTIFY_ZALO")
+        consumer = QueueConsumer(
+            self, Tenant(prefix_id=prefix_id), callback_registry,
+            auto_ack=auto_ack,
+            retry_policy=retry_policy,
+            on_parked=on_parked,
+            circuit_breaker=circuit_breaker,
+            coalescer=coalescer,
+            queue_name=queue_name
+        )
+        return self.start_consumers([consumer])
+
+    def consume_tenants(self, tenants: List[Tenant], callback_registry, auto_ack=False, retry_policy: RetryPolicy|None = None,
+                        on_parked=None, coalescer_factory: Callable[[], NotificationCoalescer|None]|None = None):
+        """
+        Consume the queues of several tenants over this connection, one channel per queue
+
+        Parameters:
+        - tenants: Tenants to consume, each with its own queue, base url and (optional) bot
+        - callback_registry: Mapping of action_type to the callback handling it
         - auto_ack: Whether to automatically acknowledge received messages
+        - retry_policy: Backoff policy of failed messages (default: from env)
+        - on_parked: Called with (body, bot=, logger=) when a message is parked for good
+        - coalescer_factory: Creates the coalescer of each tenant (or None to disable it)
         """
+        consumers = []
+        for tenant in tenants:
+            bot = tenant.bot or self.zalo_bot
+            consumers.append(QueueConsumer(
+                self, tenant, callback_registry,
+                auto_ack=auto_ack,
+                retry_policy=retry_policy,
+                on_parked=on_parked,
+                circuit_breaker=getattr(bot, "breaker", None),
+                coalescer=coalescer_factory() if coalescer_factory else None
+            ))
+        return self.start_consumers(consumers)
+
+    def start_consumers(self, consumers: List[QueueConsumer]):
+        """Set up the consumers and start the consumer thread"""
         if not self.channel:
             self.logger.error("Connection is not established.")
             return False
-        
-        def wrapper_callback(ch, method, properties, body):
-            """Xử lý message và gọi callback tương ứng"""
-            message = body.decode('utf-8')
-            # Payload format: <_>|<actioType>|<taskId>#<payload>
-            data_fragment = message.split("|")
-            action_type = data_fragment[1]
-
-            callback = callback_registry.get(action_type)
-            if not callback:
-                self.logger.warning(f"No handler found for action_type: {action_type}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-                return
-            
-            # Truyền thêm logger vào callback
-            callback(ch, method, properties, body, bot=self.zalo_bot, logger=self.logger)
-        
+        if self.consumer_thread and self.consumer_thread.is_alive():
+            self.logger.error("Consumers are already running.")
+            return False
+
+        if self.prefetch_count == 0 and any(consumer.circuit_breaker is not None for consumer in consumers):
+            # Unlimited, the whole backlog would be buffered here and requeued at once when the breaker opens
+            self.prefetch_count = max(1, self.breaker_prefetch_count)
+            self.logger.info(f"Circuit breaker enabled, prefetch bounded to {self.prefetch_count}.")
+
         try:
-            self.channel.queue_declare(queue=queue_name, durable=True)   # use existing or create
-            self.channel.basic_consume(queue=queue_name, on_message_callback=wrapper_callback, auto_ack=auto_ack)
+            for consumer in consumers:
+                consumer.setup()
+                self.consumers.append(consumer)
+                self.circuit_breaker = self.circuit_breaker or consumer.circuit_breaker
+        except Exception as e:
+            self.logger.error(f"Failed to setup consumer: {e}")
+            return False
 
-            # Run in a separate thread
-            def run_consumer():
-                self.is_consuming = True
-                try:
-                    while self.is_consuming:
-                        try:
-                            self.channel.start_consuming()
-                        except pika.exceptions.StreamLostError as e:
-                            if self.is_consuming:
-                                self.logger.error(f"Stream connection lost: {e}.\nAttempting to reconnect...")
-                                if self.reconnect():
-                                    self.channel.queue_declare(queue=queue_name, durable=True)
-                                    self.channel.basic_consume(queue=queue_name, on_message_callback=wrapper_callback, auto_ack=auto_ack)
-                                else:
-                                    self.logger.error("Failed to reconnect to RabbitMQ. Stopping consumer.")
-                                    break
-                        except pika.exceptions.ChannelClosedByBroker as e:
-                            if self.is_consuming:
-                                self.logger.error(f"Channel closed by broker: {e}.\nAttempting to reconnect...")
-                                if self.reconnect():
-                                    self.channel.queue_declare(queue=queue_name, durable=True)
-                                    self.channel.basic_consume(queue=queue_name, on_message_callback=wrapper_callback, auto_ack=auto_ack)
-                                else:
-                                    self.logger.error("Failed to reconnect to RabbitMQ. Stopping consumer.")
-                                    break
-                except Exception as e:
-                    self.logger.error(f"Failed to setup consumer: {e}")
-                finally:
-                    self.logger.info("Consumer stopped.")
+        self._schedule_periodic_tasks()
 
-            self.consumer_thread = threading.Thread(target=run_consumer, daemon=True)
-            self.consumer_thread.start()
-            self.logger.info(f"Consumer started for queue: {queue_name}")
-            return True
+        self.is_consuming = True
+        # Run in a separate thread, the only one using the connection from now on
+        self.consumer_thread = threading.Thread(target=self._run_consumer, name="amqp-io", daemon=True)
+        self.consumer_thread.start()
+        for index in range(max(1, self.handler_workers)):
+            worker = threading.Thread(target=self._run_worker, name=f"handler-{index}", daemon=True)
+            worker.start()
+            self.worker_threads.append(worker)
+        return True
+
+    def _run_worker(self):
+        """Run the scheduled deliveries, in fair order across tenants"""
+        while self.is_consuming:
+            task = self.scheduler.get(timeout=0.5)
+            if task is None:
+                continue
+            started = time.perf_counter()
+            try:
+                task()
+            except Exception as e:
+                self.logger.error(f"Handler worker failed: {e}")
+            finally:
+                if self.prefetch_controller is not None:
+                    self.prefetch_controller.observe_service(time.perf_counter() - started)
+
+    def _run_consumer(self):
+        """
+        I/O loop: service the connection (deliveries, heartbeats, timers and the
+        callbacks queued by handler workers). Handlers never run on this thread,
+        so a slow Zalo call can't delay heartbeats.
+        """
+        self._io_thread_ident = threading.get_ident()
+        try:
+            while self.is_consuming:
+                try:
+                    self.connection.process_data_events(time_limit=0.1)
+                except (pika.exceptions.AMQPConnectionError, pika.exceptions.ChannelClosedByBroker) as e:
+                    # Includes StreamLostError and the blocked-connection timeout
+                    if self.is_consuming:
+                        self.logger.error(f"Connection lost: {e}.\nAttempting to reconnect...")
+                        if not self._reconnect_consumers():
+                            self.logger.error("Failed to reconnect to RabbitMQ. Stopping consumer.")
+                            break
         except Exception as e:
             self.logger.error(f"Failed to setup consumer: {e}")
+        finally:
+            self._io_thread_ident = None
+            self.is_consuming = False
+            self.logger.info("Consumer stopped.")
+
+    def _reconnect_consumers(self):
+        # Scheduled deliveries belong to the closed channels, the broker redelivers them
+        dropped = self.scheduler.clear()
+        if dropped:
+            self.logger.warning(f"Dropped {dropped} pending delivery(ies), the broker will redeliver them.")
+        if not self.reconnect():
             return False
-    
-    def reconnect(self):
+        for consumer in self.consumers:
+            consumer.setup()
+        self._schedule_periodic_tasks()
+        return True
+
+    def add_periodic_task(self, interval: float, func):
+        """
+        Run `func` every `interval` seconds on the I/O thread (it may use the connection).
+        Must be called before `start_consumers`.
+        """
+        self.periodic_tasks.append((interval, func))
+
+    def _schedule_periodic_tasks(self):
+        connection = self.connection
+
+        def run(interval, func):
+            # Timers of a closed connection are dropped, the new one has its own
+            if connection is not self.connection or not connection.is_open:
+                return
+            try:
+                func()
+            except Exception as e:
+                self.logger.error(f"Periodic task {getattr(func, '__name__', func)} failed: {e}")
+            connection.call_later(interval, functools.partial(run, interval, func))
+
+        for interval, func in self.periodic_tasks:
+            connection.call_later(interval, functools.partial(run, interval, func))
+
+    def _log_metrics(self):
+        for prefix_id, metrics in self.metrics().items():
+            self.logger.info(f"[{prefix_id}] metrics: {metrics} - pending: {self.scheduler.pending(prefix_id)}")
+
+    def is_connected(self):
+        """Connection open and consumers running"""
+        return bool(
+            self.connection and self.connection.is_open
+            and self.consumer_thread and self.consumer_thread.is_alive()
+        )
+
+    def run_on_io_thread(self, func, timeout: float = 10.0):
+        """
+        Run `func` on the thread owning the connection and return its result.
+
+        Called directly when the I/O thread isn't running or from the I/O thread itself.
+        """
+        if self._io_thread_ident is None or threading.get_ident() == self._io_thread_ident:
+            return func()
+
+        done = threading.Event()
+        result = {}
+
+        def call():
+            try:
+                result["value"] = func()
+            except Exception as e:
+                result["error"] = e
+            finally:
+                done.set()
+
+        self.connection.add_callback_threadsafe(call)
+        if not done.wait(timeout):
+            raise TimeoutError(f"I/O thread did not run the call within {timeout}s.")
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+
+    def call_later_threadsafe(self, delay: float, func):
+        """Schedule a timer on the I/O thread from any thread"""
+        self.connection.add_callback_threadsafe(lambda: self.connection.call_later(delay, func))
+
+    def run_in_background(self, func, *args, **kwargs):
+        """Run a best-effort task off the consumer thread"""
+        threading.Thread(target=func, args=args, kwargs=kwargs, daemon=True).start()
+
+    def metrics(self):
+        """Per-tenant consumer metrics"""
+        return {consumer.tenant.prefix_id: consumer.metrics.snapshot() for consumer in self.consumers}
+
+    def reconnect(self, retries=5):
         """Reconnect to RabbitMQ"""
         try:
             if self.connection and not self.connection.is_closed:
                 self.connection.close()
             
-            return self.connect()
+            return self.connect(retries=retries)
         except Exception as e:
             self.logger.error(f"Error while reconnecting: {e}")
             return False
@@ -288,28 +508,196 @@ class RabbitMQ:
         - routing_key: Routing key for the message
         - properties: Additional properties for the message
         """
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2) # make message persistent
+        message, properties = self.compress(message, properties)
+        if self.outbox is not None:
+            return self._publish_or_store(message, exchange, routing_key, properties)
+
         if not self.channel:
             self.logger.error("Connection is not established.")
             return False
 
         try:
-            if properties is None:
-                properties = pika.BasicProperties(delivery_mode=2) # make message persistent
-
-            self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=message, properties=properties)
+            self.run_on_io_thread(lambda: self.channel.basic_publish(
+                exchange=exchange, routing_key=routing_key, body=message, properties=properties
+            ))
             
             self.logger.info(f"Published message to exchange {exchange} with routing key {routing_key}")
             self.logger.debug(f"Message: {message}")
             return True
         except pika.exceptions.ChannelClosedByBroker as e:
             self.logger.error(f"Channel closed by broker while publishing: {e}.\nAttempting to reconnect...")
-            if self.reconnect():
+            # While consuming, the I/O thread owns the connection and reconnects it
+            if self._io_thread_ident is None and self.reconnect():
                 return self.publish(message, exchange, routing_key, properties)
             return False
         except Exception as e:
             self.logger.error(f"Failed to publish message: {e}")
             return False
     
+    def compress(self, message, properties):
+        """
+        Compress a large body, unless the producer already set an encoding.
+        Also used for the messages republished straight to a channel (retries, parking).
+
+        Returns:
+            (body, properties), the caller's properties are left untouched.
+        """
+        if not self.compress_threshold or properties.content_encoding:
+            return message, properties
+        body = message.encode('utf-8') if isinstance(message, str) else message
+        compressed, encoding = compress_body(body, self.compress_threshold, self.compress_encoding, self.compress_level)
+        if encoding is None:
+            return message, properties
+        properties = copy.copy(properties)
+        properties.content_encoding = encoding
+        return compressed, properties
+
+    def _broker_available(self):
+        return bool(self.connection and self.connection.is_open and self.channel and self.channel.is_open)
+
+    def _basic_publish(self, exchange, routing_key, body, properties):
+        publish = functools.partial(
+            self.channel.basic_publish,
+            exchange=exchange, routing_key=routing_key, body=body, properties=properties
+        )
+        if self._io_thread_ident is None:
+            # No I/O thread: only the flusher publishes, it shares the connection with its reconnects
+            with self._publish_lock:
+                return publish()
+        return self.run_on_io_thread(publish, timeout=self.publish_timeout)
+
+    def _publish_or_store(self, message, exchange, routing_key, properties):
+        """
+        Publish straight to the broker when it is up, the outbox is empty and
+        the I/O thread can bound the wait, otherwise (or if the confirm is
+        nacked / slower than `publish_timeout`) append to the outbox. Never
+        blocks on the broker for longer than `publish_timeout`.
+        """
+        # Without the I/O thread a blocking publish can't be timed out, the flusher sends it instead
+        if self._io_thread_ident is not None and not len(self.outbox) and self._broker_available():
+            try:
+                self._basic_publish(exchange, routing_key, message, properties)
+                self.logger.info(f"Published message to exchange {exchange} with routing key {routing_key}")
+                self.logger.debug(f"Message: {message}")
+                return True
+            except Exception as e:
+                # A timed out publish may still go through, the outbox copy then makes a duplicate
+                self.logger.warning(f"Failed to publish message, storing it in the outbox: {e}")
+
+        try:
+            self.outbox.append(exchange, routing_key, properties, message)
+        except OutboxFullError as e:
+            self.logger.error(f"Failed to publish message: {e}")
+            return False
+        self.logger.info(f"Stored message to {exchange or routing_key} in the outbox ({len(self.outbox)} pending)")
+        return True
+
+    def _start_outbox_flusher(self):
+        if self.outbox_thread and self.outbox_thread.is_alive():
+            return
+        self._outbox_stop.clear()
+        self.outbox_thread = threading.Thread(target=self._run_outbox_flusher, name="outbox-flusher", daemon=True)
+        self.outbox_thread.start()
+
+    def _reopen_channel(self):
+        """
+        Open the main channel again after the broker closed it (e.g. a publish
+        to a missing exchange), the connection itself is still up. Runs on
+        the I/O thread: while consuming, nothing else notices a closed channel.
+        """
+        if not (self.connection and self.connection.is_open) or (self.channel and self.channel.is_open):
+            return
+        self.channel = self.connection.channel()
+        if self.outbox is not None:
+            self.channel.confirm_delivery()
+        self.logger.warning("Main channel was closed by the broker, reopened it.")
+
+    def _restore_broker(self):
+        """Flusher side: reopen what is needed to publish again"""
+        if self._io_thread_ident is not None:
+            # While consuming the I/O thread owns the connection and reconnects it, only the channel is ours
+            if self.connection and self.connection.is_open:
+                self.run_on_io_thread(self._reopen_channel, timeout=self.publish_timeout)
+            return
+        with self._publish_lock:
+            if self.connection and self.connection.is_open:
+                self._reopen_channel()
+            else:
+                self.reconnect(retries=1)
+
+    def _park_outbox_record(self, record, error):
+        """Move a message the broker keeps refusing out of the way of the ones behind it"""
+        headers = dict(record.properties.get("headers") or {})
+        headers.update({
+            "x-outbox-exchange": record.exchange,
+            "x-outbox-routing-key": record.routing_key,
+            "x-last-error": f"{type(error).__name__}: {error}"[:512],
+        })
+        properties = pika.BasicProperties(**{**record.properties, "headers": headers})
+        self.run_on_io_thread(
+            lambda: self.channel.queue_declare(queue=self.outbox_parking_queue, durable=True),
+            timeout=self.publish_timeout
+        )
+        self._basic_publish('', self.outbox_parking_queue, record.body, properties)
+
+    def _run_outbox_flusher(self, reconnect_delay: float = 2.0):
+        """Publish the outbox in order whenever the broker is reachable"""
+        # Refusals of the head message in a row
+        failures = 0
+        while not self._outbox_stop.is_set():
+            if not self.outbox.wait(timeout=1.0):
+                self.outbox.sync()
+                continue
+
+            if not self._broker_available():
+                try:
+                    self._restore_broker()
+                except Exception as e:
+                    self.logger.warning(f"Failed to reopen the broker channel: {e}")
+                if not self._broker_available():
+                    self._outbox_stop.wait(reconnect_delay)
+                continue
+
+            record = self.outbox.peek()
+            if record is None:
+                continue
+            try:
+                self._basic_publish(
+                    record.exchange, record.routing_key, record.body, pika.BasicProperties(**record.properties)
+                )
+            except (pika.exceptions.ChannelClosedByBroker, pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+                # Refused by the broker, unlike a lost connection or a timeout this may never succeed
+                failures += 1
+                if failures < self.outbox_max_attempts:
+                    self.logger.warning(
+                        f"Broker refused outbox message to {record.exchange or record.routing_key} "
+                        f"({failures}/{self.outbox_max_attempts}): {e}"
+                    )
+                    self._outbox_stop.wait(reconnect_delay)
+                    continue
+                try:
+                    if not self._broker_available():
+                        self._restore_broker()
+                    self._park_outbox_record(record, e)
+                except Exception as park_error:
+                    self.logger.error(f"Failed to park refused outbox message: {park_error}")
+                    self._outbox_stop.wait(reconnect_delay)
+                    continue
+                self.logger.error(
+                    f"Parked outbox message to {record.exchange or record.routing_key} in "
+                    f"{self.outbox_parking_queue} after {failures} refusal(s): {e}"
+                )
+            except Exception as e:
+                self.logger.warning(f"Failed to flush outbox ({len(self.outbox)} pending): {e}")
+                self._outbox_stop.wait(reconnect_delay)
+                continue
+            failures = 0
+            self.outbox.commit()
+            if not len(self.outbox):
+                self.logger.info("Outbox flushed.")
+
     def publish_to_queue(self, message, queue_name):
         """
         Directly publish a message to a queue (using default exchange)
@@ -318,5 +706,7 @@ class RabbitMQ:
         - message: Message body to be published
         - queue_name: Name of the queue
         """
-        self.declare_queue(queue_name, durable=True)
+        # The outbox keeps the message until the broker is back, the queue is declared by its consumer
+        if self.outbox is None or self._broker_available():
+            self.run_on_io_thread(lambda: self.declare_queue(queue_name, durable=True))
         return self.publish(message=message, exchange='', routing_key=queue_name)
\ No newline at end of file
@@ -0,0 +1,42 @@
+import time
+import threading
+
+from typing import Optional
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `burst` saved up.
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be greater than 0, got {rate}")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token. Returns 0 on success, otherwise the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Wait for a token. Returns False if `stop` was set while waiting."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+import pika
+import pika.exceptions
+
+from models.compression import decompress_body
+from models.rate_limiter import TokenBucket
+from models.retry import RetryRouter
+
+# Headers of the failed attempts, dropped so a replayed message gets its full retry budget again
+RESET_HEADERS = (RetryRouter.ATTEMPT_HEADER, RetryRouter.MAX_ATTEMPTS_HEADER, RetryRouter.ERROR_HEADER, "x-death")
+REPLAY_COUNT_HEADER = "x-replay-count"
+
+class QueueReplayer:
+    """
+    Move the messages of a dead-letter / parking queue back to a queue to consume.
+
+    Messages are pulled one by one with `basic_get` on a channel in confirm
+    mode and published to `target` at most `rate` per second. The source
+    message is acked only once the broker confirmed its copy, so a crash
+    never loses one (at worst it is replayed twice). Messages that don't
+    match the filters stay unacked until the end of the run, then go back
+    to the source queue in their original order.
+
+    Filters: `action_types` (the second field of the envelope) and the age
+    of the message, from its `timestamp` property or its first `x-death`
+    entry (a message of unknown age never matches an age filter).
+    `dry_run` only counts what would be replayed. Progress is written to
+    `checkpoint_path` every `checkpoint_every` messages and on exit, a rerun
+    with the same checkpoint carries on its replayed total.
+    """
+    def __init__(
+            self,
+            rabbitmq,
+            source: str,
+            target: str,
+            rate: float = 1.0,
+            action_types: Optional[Set[str]] = None,
+            min_age: Optional[float] = None,
+            max_age: Optional[float] = None,
+            limit: Optional[int] = None,
+            dry_run: bool = False,
+            checkpoint_path: Optional[str] = None,
+            checkpoint_every: int = 100,
+            logger=None
+            ):
+        if rate <= 0:
+            raise ValueError(f"Replay rate must be greater than 0, got {rate}")
+        self.rabbitmq = rabbitmq
+        self.source = source
+        self.target = target
+        self.rate = rate
+        self.action_types = action_types
+        self.min_age = min_age
+        self.max_age = max_age
+        self.limit = limit
+        self.dry_run = dry_run
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.logger = logger or rabbitmq.logger
+        self.progress: Dict[str, Any] = self._load_checkpoint()
+        self.matched_by_action: Counter = Counter()
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        progress = {"source": self.source, "target": self.target, "replayed": 0, "skipped": 0, "failed": 0}
+        if not self.checkpoint_path or self.dry_run:
+            return progress
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return progress
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Ignoring unreadable checkpoint: {e}")
+            return progress
+        if saved.get("source") != self.source or saved.get("target") != self.target:
+            self.logger.warning("Checkpoint is for another source/target, starting over.")
+            return progress
+        self.logger.info(f"Resuming from checkpoint: {saved.get('replayed', 0)} message(s) already replayed.")
+        # Filtered out and refused messages are back in the source queue, only the replayed total carries on
+        progress["replayed"] = saved.get("replayed", 0)
+        return progress
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path or self.dry_run:
+            return
+        self.progress["updated_at"] = time.time()
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    @staticmethod
+    def action_type_of(properties, body: bytes) -> Optional[str]:
+        try:
+            text = decompress_body(body, properties.content_encoding).decode("utf-8")
+            return text.split("|")[1]
+        except (ValueError, UnicodeDecodeError, IndexError):
+            return None
+
+    @staticmethod
+    def age_of(properties) -> Optional[float]:
+        """Seconds since the message was published, None if unknown"""
+        published_at = properties.timestamp
+        if published_at is None:
+            deaths = (properties.headers or {}).get("x-death") or []
+            died_at = deaths[-1].get("time") if deaths else None
+            if isinstance(died_at, datetime):
+                # pika decodes AMQP timestamps as naive UTC datetimes
+                published_at = (died_at if died_at.tzinfo else died_at.replace(tzinfo=timezone.utc)).timestamp()
+        if published_at is None:
+            return None
+        return time.time() - float(published_at)
+
+    def matches(self, properties, body: bytes) -> Optional[str]:
+        """Action type of a message to replay, None if it is filtered out"""
+        action_type = self.action_type_of(properties, body)
+        if self.action_types and action_type not in self.action_types:
+            return None
+        if self.min_age is not None or self.max_age is not None:
+            age = self.age_of(properties)
+            if age is None:
+                return None
+            if self.min_age is not None and age < self.min_age:
+                return None
+            if self.max_age is not None and age > self.max_age:
+                return None
+        return action_type or "unknown"
+
+    def _replay_properties(self, properties):
+        headers = {key: value for key, value in (properties.headers or {}).items() if key not in RESET_HEADERS}
+        headers[REPLAY_COUNT_HEADER] = int(headers.get(REPLAY_COUNT_HEADER) or 0) + 1
+        return pika.BasicProperties(
+            content_type=properties.content_type,
+            content_encoding=properties.content_encoding,
+            message_id=properties.message_id,
+            timestamp=properties.timestamp,
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+            headers=headers,
+        )
+
+    def run(self) -> Dict[str, Any]:
+        """Replay (or count) the matching messages. Returns the progress of the run."""
+        connection = self.rabbitmq.connection
+        channel = connection.channel()
+        # basic_publish now blocks until the broker confirms, and raises if it nacks
+        channel.confirm_delivery()
+        bucket = TokenBucket(self.rate, burst=1)
+        handled = 0
+        try:
+            channel.queue_declare(queue=self.target, durable=True, passive=True)
+            while self.limit is None or handled < self.limit:
+                method, properties, body = channel.basic_get(queue=self.source, auto_ack=False)
+                if method is None:
+                    # Empty, or only filtered out messages left (they are unacked)
+                    break
+
+                action_type = self.matches(properties, body)
+                if action_type is None:
+                    self.progress["skipped"] += 1
+                    continue
+                handled += 1
+                self.matched_by_action[action_type] += 1
+                if self.dry_run:
+                    continue
+
+                # Pace with the connection's sleep so heartbeats keep flowing
+                wait = bucket.try_acquire()
+                while wait:
+                    connection.sleep(wait)
+                    wait = bucket.try_acquire()
+
+                try:
+                    channel.basic_publish(
+                        exchange="", routing_key=self.target, body=body,
+                        properties=self._replay_properties(properties), mandatory=True
+                    )
+                except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+                    # Left unacked, back in the source queue at the end of the run
+                    self.progress["failed"] += 1
+                    self.logger.error(f"Broker refused replayed message: {e}")
+                    continue
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                self.progress["replayed"] += 1
+
+                if self.progress["replayed"] % self.checkpoint_every == 0:
+                    self._save_checkpoint()
+                    self.logger.info(f"Replayed {self.progress['replayed']} message(s) to {self.target}.")
+        finally:
+            self._save_checkpoint()
+            if channel.is_open:
+                # Requeues the messages left unacked (filtered out or refused)
+                channel.close()
+
+        self.progress["matched"] = dict(self.matched_by_action)
+        return self.progress
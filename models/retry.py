@@ -0,0 +1,154 @@
+import os
+
+import pika
+import pika.spec
+
+from typing import Callable, Dict, List, Optional
+
+class TransientError(Exception):
+    """Error that may succeed on a later attempt (network, Zalo throttling, ...)"""
+
+class PermanentError(Exception):
+    """Error that will fail again on every attempt (bad payload, unknown recipient, ...)"""
+
+# Errors caused by the message itself, retrying them is pointless.
+# `ValueError` also covers `json.JSONDecodeError` and pydantic `ValidationError`.
+PERMANENT_ERRORS = (PermanentError, ValueError, KeyError, TypeError, AttributeError, IndexError)
+
+def is_transient(error: BaseException) -> bool:
+    """Classify an error raised by a handler"""
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, PERMANENT_ERRORS):
+        return False
+    # Unknown errors (network, zlapi, ...) are assumed to be transient
+    return True
+
+class RetryPolicy:
+    """Exponential backoff: `base_delay * multiplier ** (attempt - 1)`, capped at `max_delay`"""
+    def __init__(self, base_delay: float = 2.0, multiplier: float = 2.0, max_delay: float = 600.0, max_attempts: int = 5):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1.")
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            base_delay=float(os.getenv("RETRY_BASE_DELAY", 2.0)),
+            multiplier=float(os.getenv("RETRY_MULTIPLIER", 2.0)),
+            max_delay=float(os.getenv("RETRY_MAX_DELAY", 600.0)),
+            max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", 5)),
+        )
+
+    def delay_ms(self, attempt: int) -> int:
+        """Delay before the given retry attempt (1-based), in milliseconds"""
+        # Attempts past the policy limit (allowed by a message header) reuse the longest delay
+        attempt = max(1, min(attempt, self.max_attempts - 1))
+        delay = min(self.base_delay * self.multiplier ** (attempt - 1), self.max_delay)
+        return int(delay * 1000)
+
+    def delays_ms(self) -> List[int]:
+        """Distinct delays used by this policy, one retry queue is declared per delay"""
+        return sorted({self.delay_ms(attempt) for attempt in range(1, max(2, self.max_attempts))})
+
+class RetryRouter:
+    """
+    Route failed deliveries of a queue to delayed retry queues or to a parking queue.
+
+    Each delay has its own queue `<queue>.retry.<delay>ms` with a message TTL,
+    expired messages are dead-lettered back to the main queue through the
+    default exchange. The consumer never sleeps: a failed delivery is
+    republished to the retry queue and acked right away. Both calls wait up
+    to `reroute_timeout` seconds for the I/O thread, so the original is only
+    acked once its copy was published.
+    """
+    ATTEMPT_HEADER = "x-retry-attempt"
+    MAX_ATTEMPTS_HEADER = "x-max-attempts"
+    ERROR_HEADER = "x-last-error"
+
+    def __init__(self, queue_name: str, policy: Optional[RetryPolicy] = None, reroute_timeout: float = 10.0,
+                 compress: Optional[Callable] = None, logger=None):
+        self.queue_name = queue_name
+        self.policy = policy or RetryPolicy()
+        self.reroute_timeout = reroute_timeout
+        # (body, properties) -> (body, properties), e.g. `RabbitMQ.compress`
+        self.compress = compress
+        self.logger = logger
+
+    @property
+    def parking_queue(self) -> str:
+        return f"{self.queue_name}.parking"
+
+    def retry_queue(self, delay_ms: int) -> str:
+        return f"{self.queue_name}.retry.{delay_ms}ms"
+
+    def declare(self, channel):
+        """Declare the retry and parking queues of the main queue"""
+        channel.queue_declare(queue=self.parking_queue, durable=True)
+        for delay_ms in self.policy.delays_ms():
+            channel.queue_declare(
+                queue=self.retry_queue(delay_ms),
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay_ms,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                }
+            )
+
+    def handle_failure(self, ch, method, properties, body, error: BaseException) -> Optional[str]:
+        """
+        Republish a failed delivery for a later attempt or park it, then ack the original.
+
+        `ch` is the `ThreadSafeChannel` of the consumer (called on a handler worker).
+
+        Returns:
+            "retry" or "parked", or None if the delivery could not be rerouted
+            (it stays unacked and is redelivered after reconnect).
+        """
+        headers: Dict = dict((properties.headers if properties else None) or {})
+        attempt = int(headers.get(self.ATTEMPT_HEADER) or 0) + 1
+        max_attempts = int(headers.get(self.MAX_ATTEMPTS_HEADER) or self.policy.max_attempts)
+
+        headers[self.ATTEMPT_HEADER] = attempt
+        headers[self.ERROR_HEADER] = f"{type(error).__name__}: {error}"[:512]
+
+        if is_transient(error) and attempt < max_attempts:
+            outcome = "retry"
+            routing_key = self.retry_queue(self.policy.delay_ms(attempt))
+        else:
+            outcome = "parked"
+            routing_key = self.parking_queue
+
+        new_properties = pika.BasicProperties(
+            content_type=properties.content_type if properties else None,
+            content_encoding=properties.content_encoding if properties else None,
+            message_id=properties.message_id if properties else None,
+            timestamp=properties.timestamp if properties else None,
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+            headers=headers,
+        )
+        if self.compress is not None:
+            # The body may have been decompressed by the consumer, retry & parking queues hold the most backlog
+            body, new_properties = self.compress(body, new_properties)
+        try:
+            ch.basic_publish(
+                exchange="", routing_key=routing_key, body=body, properties=new_properties, timeout=self.reroute_timeout
+            )
+            ch.basic_ack(delivery_tag=method.delivery_tag, timeout=self.reroute_timeout)
+        except Exception as e:
+            self._log("error", f"Failed to reroute message to {routing_key}: {e}")
+            return None
+
+        if outcome == "retry":
+            self._log("warning", f"Attempt {attempt}/{max_attempts} failed ({error}). Retrying via {routing_key}.")
+        else:
+            self._log("error", f"Message parked in {routing_key} after {attempt} attempt(s): {error}")
+        return outcome
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+
+from typing import Any, Dict, Optional
+
+from utils.logger import get_logger
+
+SNAPSHOT_VERSION = 1
+
+logger = get_logger("Session")
+
+def save_session_snapshot(path: str, phone: str, session: Dict[str, Any]) -> bool:
+    """
+    Persist a Zalo session snapshot to disk.
+
+    The file is written to a temp file first and then renamed, so a crash
+    during the write never leaves a half-written snapshot behind.
+
+    Args:
+        path: Snapshot file path.
+        phone: Phone number the session belongs to.
+        session: Session state returned by `ZaloBot.export_session()`.
+
+    Returns:
+        True if the snapshot was saved.
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "phone": phone,
+        "saved_at": time.time(),
+        "session": session,
+    }
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Snapshot contains login secrets, keep it private to the owner
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved session snapshot to {path}")
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Failed to save session snapshot: {e}")
+        return False
+
+def load_session_snapshot(path: str, phone: str, max_age: int) -> Optional[Dict[str, Any]]:
+    """
+    Load and validate a Zalo session snapshot.
+
+    A snapshot is rejected if it is missing, unreadable, from another
+    snapshot version, for another phone number, older than `max_age`
+    seconds or missing the cookies / secret key.
+
+    Returns:
+        The session state to pass to `ZaloBot.restore_session()`, or None.
+    """
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        logger.info("No session snapshot found.")
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Failed to read session snapshot: {e}")
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.warning("Session snapshot version mismatch.")
+        return None
+    if snapshot.get("phone") != phone:
+        logger.warning("Session snapshot belongs to another account.")
+        return None
+
+    age = time.time() - float(snapshot.get("saved_at") or 0)
+    if age < 0 or age > max_age:
+        logger.info(f"Session snapshot expired ({int(age)}s old).")
+        return None
+
+    session = snapshot.get("session") or {}
+    if not session.get("cookies") or not session.get("secret_key"):
+        logger.warning("Session snapshot is incomplete.")
+        return None
+    return session
+
+def discard_session_snapshot(path: str):
+    """Remove a snapshot that turned out to be invalid"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove session snapshot: {e}")
@@ -0,0 +1,18 @@
+from typing import Optional
+
+from interfaces import IZaloBot
+
+class Tenant:
+    """A tenant served by this process: its queue prefix, base url and Zalo account"""
+    def __init__(self, prefix_id: str, base_url: Optional[str] = None, bot: Optional[IZaloBot] = None):
+        self.prefix_id = prefix_id
+        self.base_url = base_url
+        # None = use the default bot of the process
+        self.bot = bot
+
+    @property
+    def queue_name(self) -> str:
+        return f"{self.prefix_id}_NOTIFY_ZALO"
+
+    def __repr__(self):
+        return f"Tenant({self.prefix_id})"
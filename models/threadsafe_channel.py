@@ -0,0 +1,74 @@
+import threading
+import functools
+
+class ThreadSafeChannel:
+    """
+    Channel proxy handed to handlers running on worker threads.
+
+    pika connections are not thread-safe: every call is queued with
+    `add_callback_threadsafe` and run by the thread that owns the
+    connection, in the order it was made. Calls are fire-and-forget, an
+    error (e.g. the channel closed meanwhile) is logged and the broker
+    redelivers the unacked message after reconnect. Given a `timeout`, a
+    call waits until it ran instead and raises its error (or TimeoutError),
+    for callers that must know the outcome.
+    """
+    def __init__(self, channel, connection, logger=None):
+        self._channel = channel
+        self._connection = connection
+        self._logger = logger
+
+    @property
+    def is_open(self):
+        return self._channel.is_open
+
+    def basic_ack(self, delivery_tag=0, multiple=False, timeout=None):
+        self._call(self._channel.basic_ack, timeout, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True, timeout=None):
+        self._call(self._channel.basic_nack, timeout, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True, timeout=None):
+        self._call(self._channel.basic_reject, timeout, delivery_tag=delivery_tag, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False, timeout=None):
+        self._call(
+            self._channel.basic_publish,
+            timeout,
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+            mandatory=mandatory
+        )
+
+    def _call(self, func, timeout, **kwargs):
+        done = threading.Event() if timeout is not None else None
+        result = {}
+        try:
+            self._connection.add_callback_threadsafe(functools.partial(self._run, func, kwargs, done, result))
+        except Exception as e:
+            self._log(f"Failed to schedule {func.__name__}: {e}")
+            raise
+        if done is None:
+            return
+        if not done.wait(timeout):
+            raise TimeoutError(f"{func.__name__} did not run within {timeout}s.")
+        if "error" in result:
+            raise result["error"]
+
+    def _run(self, func, kwargs, done=None, result=None):
+        try:
+            func(**kwargs)
+        except Exception as e:
+            if done is not None:
+                result["error"] = e
+            else:
+                self._log(f"Failed to run {func.__name__}: {e}")
+        finally:
+            if done is not None:
+                done.set()
+
+    def _log(self, message):
+        if self._logger:
+            self._logger.error(message)
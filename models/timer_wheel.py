@@ -0,0 +1,114 @@
+import math
+import time
+import threading
+
+from typing import Any, Callable, Dict, List, Optional
+
+class _Timer:
+    __slots__ = ("timer_id", "deadline_tick", "payload")
+
+    def __init__(self, timer_id, deadline_tick: int, payload):
+        self.timer_id = timer_id
+        self.deadline_tick = deadline_tick
+        self.payload = payload
+
+class TimerWheel:
+    """
+    Hashed timer wheel: `slots` buckets of `tick` seconds each.
+
+    A timer due at wall-clock time `deadline` goes in bucket
+    `ceil(deadline / tick) % slots`; timers more than one revolution away stay in
+    their bucket until their tick comes round. Insert and cancel are O(1) (a
+    dict per bucket plus an id -> bucket map), each tick only looks at one
+    bucket. A single thread drives the wheel and calls
+    `on_expire(timer_id, payload)` for every due timer, so expiry handlers
+    must be quick. Resolution is one tick: a timer fires up to one tick
+    late, never early.
+    """
+    def __init__(self, on_expire: Callable[[Any, Any], None], tick: float = 1.0, slots: int = 3600, logger=None):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.slots = slots
+        self.logger = logger
+        self._buckets: List[Dict[Any, _Timer]] = [{} for _ in range(slots)]
+        self._timers: Dict[Any, _Timer] = {}
+        self._current_tick = self._tick_of(time.time())
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick)
+
+    def _deadline_tick_of(self, deadline: float) -> int:
+        # Rounded up, the tick of a deadline must not start before it
+        return math.ceil(deadline / self.tick)
+
+    def schedule(self, timer_id, deadline: float, payload=None):
+        """Add (or move) timer `timer_id`, due at `deadline` (epoch seconds)"""
+        with self._lock:
+            self._remove(timer_id)
+            # Past deadlines fire on the next tick
+            deadline_tick = max(self._deadline_tick_of(deadline), self._current_tick + 1)
+            timer = _Timer(timer_id, deadline_tick, payload)
+            self._buckets[deadline_tick % self.slots][timer_id] = timer
+            self._timers[timer_id] = timer
+
+    def cancel(self, timer_id) -> bool:
+        with self._lock:
+            return self._remove(timer_id)
+
+    def _remove(self, timer_id) -> bool:
+        timer = self._timers.pop(timer_id, None)
+        if timer is None:
+            return False
+        del self._buckets[timer.deadline_tick % self.slots][timer_id]
+        return True
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, timer_id):
+        return timer_id in self._timers
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=3)
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            self._advance(self._tick_of(now))
+            self._stop.wait(self.tick - now % self.tick)
+
+    def _advance(self, now_tick: int):
+        """Expire the buckets of the ticks elapsed since the last call"""
+        with self._lock:
+            if now_tick <= self._current_tick:
+                return
+            # After a long pause (or a clock jump) one revolution covers every bucket
+            first_tick = max(self._current_tick + 1, now_tick - self.slots + 1)
+            expired = []
+            for tick in range(first_tick, now_tick + 1):
+                bucket = self._buckets[tick % self.slots]
+                due = [timer for timer in bucket.values() if timer.deadline_tick <= now_tick]
+                for timer in due:
+                    del bucket[timer.timer_id]
+                    del self._timers[timer.timer_id]
+                expired.extend(due)
+            self._current_tick = now_tick
+
+        for timer in expired:
+            try:
+                self.on_expire(timer.timer_id, timer.payload)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Timer {timer.timer_id} failed: {e}")
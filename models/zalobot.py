@@ -1,18 +1,137 @@
+import os
+import time
+import threading
+
 from zlapi import ZaloAPI
-from zlapi.models import *
+from zlapi.models import ThreadType, User, Group
 from zlapi._message import Message
 from interfaces import IZaloBot
+from models.circuit_breaker import CircuitBreaker
+from models.inbound import InboundDispatcher, InboundEvent
+from models.cache import TTLCache
+from models.rate_limiter import TokenBucket
+from models.friend_index import FriendIndex
+from models.friend_requests import FriendRequestTracker
+from models.conversation_store import ConversationStore
 from utils.logger import setup_logger
 
 class ZaloBot(ZaloAPI, IZaloBot):
-    def __init__(self, phone=None, password=None, imei=None, cookies=None, user_agent=None, auto_login=True, logger=None):
+    def __init__(self, phone=None, password=None, imei=None, cookies=None, user_agent=None, auto_login=True, logger=None,
+                 friend_requests: FriendRequestTracker = None, conversations: ConversationStore = None):
         super().__init__(phone, password, imei, cookies, user_agent, auto_login)
         self.logger = logger or setup_logger(name="ZaloBot", log_file="zalobot.log")
+        # Guard the send path, opens when Zalo is down or throttling us
+        self.breaker = CircuitBreaker.from_env("zalo-send", logger=self.logger)
+        # Zalo limits the messages of an account, every send of this bot (notifications and broadcasts) takes a token
+        self.send_limiter = TokenBucket(float(os.getenv("ZALO_SEND_RATE", 1)), int(os.getenv("ZALO_SEND_BURST", 5)))
+        # Inbound messages are processed by workers, never on the listener thread
+        self.inbound = InboundDispatcher.from_env(self._handle_message, logger=self.logger)
+        # Profiles & group info are looked up for every inbound message, keep them for a while
+        cache_ttl = float(os.getenv("USER_CACHE_TTL", 600))
+        self.user_cache = TTLCache(ttl=cache_ttl, maxsize=int(os.getenv("USER_CACHE_SIZE", 10000)))
+        self.group_cache = TTLCache(ttl=cache_ttl, maxsize=1000)
+        # Phone number -> uid, a number keeps its account for much longer than a profile stays fresh
+        self.uid_cache = TTLCache(
+            ttl=float(os.getenv("UID_CACHE_TTL", 24 * 3600)),
+            maxsize=int(os.getenv("UID_CACHE_SIZE", 100000))
+        )
+        self.friends = FriendIndex(
+            # zlapi keeps the raw payload keys, the uid of a friend is `userId`
+            lambda: [friend.userId for friend in self.fetchAllFriends() if friend.userId],
+            refresh_interval=float(os.getenv("FRIEND_INDEX_REFRESH", 900)),
+            retry_interval=float(os.getenv("FRIEND_INDEX_RETRY", 60)),
+            logger=self.logger
+        )
+        self.friend_requests = friend_requests if friend_requests is not None else FriendRequestTracker(logger=self.logger)
+        # Conversation history for the help desk, None if MongoDB is not configured
+        self.conversations = conversations
+        # Readiness probes ask Zalo at most this often, the last answer is reused in between
+        self.session_check_interval = float(os.getenv("SESSION_CHECK_INTERVAL", 60))
+        self._session_valid = bool(self.user_id) and self.isLoggedIn()
+        self._session_checked_at = time.monotonic() if self._session_valid else None
+        self._session_check_lock = threading.Lock()
+
+    def export_session(self):
+        """
+        Export the current login state so it can be restored without a full login
+        """
+        return {
+            "cookies": self.getSession(),
+            "secret_key": self.getSecretKey(),
+            "imei": getattr(self, "_imei", None),
+            "user_id": self.user_id,
+            "config": dict(getattr(self._state, "_config", None) or {}),
+        }
+
+    def restore_session(self, session):
+        """
+        Restore a login state exported by `export_session`.
+
+        zlapi only marks a client logged in from `login()`, so the state is
+        restored by hand, then checked with one authenticated call.
+
+        Returns:
+            True if Zalo accepts the restored session.
+        """
+        try:
+            config = dict(session.get("config") or {})
+            config["secret_key"] = session["secret_key"]
+            self._state._config.update(config)
+            self._state.set_cookies(session["cookies"])
+            self._state._loggedin = True
+            self._state.cloud_id = config.get("send2me_id")
+            if session.get("imei"):
+                self._imei = session["imei"]
+                self._state.user_imei = session["imei"]
+            self.user_id = session.get("user_id") or config.get("send2me_id")
+            self.cloud_id = self._state.cloud_id
+        except Exception as e:
+            self.logger.warning(f"Failed to restore session: {e}")
+            return False
+
+        if not self.check_session():
+            self._state._loggedin = False
+            return False
+        return True
+
+    def check_session(self):
+        """
+        Ask Zalo whether the session is still accepted (fetches the bot's own profile)
+        """
+        try:
+            profile = self.fetchAccountInfo().profile
+            user_id = profile.get("userId") if profile else None
+        except Exception as e:
+            self.logger.warning(f"Session check failed: {e}")
+            user_id = None
+        if user_id:
+            self.user_id = user_id
+        self._session_valid = bool(user_id)
+        self._session_checked_at = time.monotonic()
+        return self._session_valid
 
     def onMessage(self, mid=None, author_id=None, message=None, message_object=None, thread_id=None, thread_type=ThreadType.USER):
-        if not isinstance(message, str):
-            return
-        
+        """Runs on the listener thread: only queue the message, `_handle_message` does the work"""
+        event = InboundEvent(
+            mid=mid,
+            author_id=author_id,
+            message=message,
+            message_object=message_object,
+            thread_id=thread_id,
+            thread_type=thread_type,
+            received_at=time.time()
+        )
+        # Every message is kept in the history, only text messages are handled
+        if self.conversations is not None:
+            self.conversations.add(event)
+        if isinstance(message, str):
+            self.inbound.submit(event)
+
+    def _handle_message(self, event: InboundEvent):
+        author_id = event.author_id
+        thread_id = event.thread_id
+        thread_type = event.thread_type
+
         if thread_type == ThreadType.USER:
             self.logger.info(f"Received message from USER - Thread ID: {thread_id}")
         elif thread_type == ThreadType.GROUP:
@@ -22,31 +141,70 @@ class ZaloBot(ZaloAPI, IZaloBot):
         
         self.print_account_info(thread_id)
 
-        user = self.fetchUserInfo(author_id)
+        user = self.get_user_info(author_id)
         is_fr = user['changed_profiles'][f'{author_id}']['isFr']
-        if is_fr is None:
-            # Truy vấn danh sách bạn bè
-            friends = self.fetchAllFriends()
-            # Duyệt và kiểm tra nếu người dùng hiện tại đã là bạn
-            for friend in friends:
-                if friend.user_id == author_id:
-                    is_fr = True
-                    break
-
-        # Gửi yêu cầu kết bạn
-        if not is_fr:
-            self.sendFriendRequest(
-                author_id, (
-                    "Chào bạn, đây là PLC Help Desk! "
-                    "Hãy kết bạn với chũng tôi để nhận hỗ trợ."
-                )
+        if is_fr:
+            self.on_friend_accepted(author_id)
+        elif is_fr is None:
+            # Tra cứu trong danh sách bạn bè đã lưu
+            is_fr = self.friends.contains(author_id)
+
+        if is_fr:
+            self.friend_requests.clear(author_id)
+            return
+
+        # Gửi yêu cầu kết bạn (bỏ qua nếu vừa gửi gần đây)
+        if not self.friend_requests.should_send(author_id):
+            self.logger.info(f"Friend request to {author_id} is still pending. Skipped.")
+            return
+
+        self.sendFriendRequest(
+            author_id, (
+                "Chào bạn, đây là PLC Help Desk! "
+                "Hãy kết bạn với chũng tôi để nhận hỗ trợ."
             )
+        )
+        self.friend_requests.record_sent(author_id)
+
+    def is_session_valid(self):
+        """
+        Kiểm tra phiên đăng nhập còn hiệu lực (hỏi Zalo tối đa mỗi `session_check_interval` giây)
+        """
+        checked_at = self._session_checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.session_check_interval:
+            return self._session_valid
+        # One check at a time, concurrent probes get the last answer meanwhile
+        if not self._session_check_lock.acquire(blocking=False):
+            return self._session_valid
+        try:
+            return self.check_session()
+        finally:
+            self._session_check_lock.release()
+
+    def get_user_info(self, userId):
+        """
+        Thông tin người dùng, lấy từ cache nếu có
+        """
+        return self.user_cache.get_or_load(str(userId), lambda: self.fetchUserInfo(userId))
+
+    def get_group_info(self, groupId):
+        """
+        Thông tin nhóm, lấy từ cache nếu có
+        """
+        return self.group_cache.get_or_load(str(groupId), lambda: self.fetchGroupInfo(groupId))
+
+    def on_friend_accepted(self, userId):
+        """
+        Cập nhật khi xác nhận đã là bạn bè
+        """
+        self.friends.add(userId)
+        self.friend_requests.clear(userId)
 
     def print_account_info(self, userId):
         """
         In thông tin tài khoản người dùng
         """
-        user = self.fetchUserInfo(userId)
+        user = self.get_user_info(userId)
         if not user or not isinstance(user, User):
             return
         self.logger.info(user)
@@ -55,7 +213,7 @@ class ZaloBot(ZaloAPI, IZaloBot):
         """
         In thông tin nhóm
         """
-        group = self.fetchGroupInfo(groupId)
+        group = self.get_group_info(groupId)
         if not group or not isinstance(group, Group):
             return
         self.logger.info(group)
@@ -63,6 +221,11 @@ class ZaloBot(ZaloAPI, IZaloBot):
     def start_listener(self):
         try:
             self.logger.info("Starting listener...")
+            self.inbound.start()
+            if self.conversations is not None:
+                self.conversations.start()
+            self.friends.start()
+            threading.Thread(target=self.friend_requests.load, daemon=True).start()
             self.listen()
             return True
         except Exception as e:
@@ -70,17 +233,40 @@ class ZaloBot(ZaloAPI, IZaloBot):
             return False
         
     def send_message(self, phone_number, message, thread_type=ThreadType.USER):
-        """Gửi tin nhắn Zalo đến số điện thoại cụ thể"""
-        profile = self.fetchPhoneNumber(phone_number)
-        # self.logger.info(profile)
+        """
+        Gửi tin nhắn Zalo đến số điện thoại cụ thể
+
+        Waits for a token of `send_limiter` first, OTPs included: past the
+        burst, a send waits up to 1 / ZALO_SEND_RATE seconds behind the others.
+        """
+        self.send_limiter.acquire()
+        self.breaker.call(self._send_message, phone_number, message, thread_type)
+
+    def resolve_uid(self, phone_number):
+        """
+        Uid của số điện thoại, lấy từ cache nếu có
+        """
+        return self.uid_cache.get_or_load(str(phone_number), lambda: self.fetchPhoneNumber(phone_number)["uid"])
 
-        user_id = profile["uid"]
+    def send_to_uid(self, user_id, message, thread_type=ThreadType.USER, paced=False):
+        """
+        Gửi tin nhắn Zalo đến uid đã biết
+
+        `paced`: the caller already took a token of `send_limiter`.
+        """
+        if not paced:
+            self.send_limiter.acquire()
+        self.breaker.call(self._send_to_uid, user_id, message, thread_type)
 
+    def _send_message(self, phone_number, message, thread_type=ThreadType.USER):
+        user_id = self.resolve_uid(phone_number)
+        self._send_to_uid(user_id, message, thread_type)
+        self.logger.info(f"Sent notification to {phone_number} successfully.")
+
+    def _send_to_uid(self, user_id, message, thread_type=ThreadType.USER):
         # Gửi thông báo
         self.sendMessage(
             thread_id=user_id,
             thread_type=thread_type,
             message=Message(text=message)
         )
-
-        self.logger.info(f"Sent notification to {phone_number} successfully.")
@@ -0,0 +1,130 @@
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+
+import pika
+
+from models.outbox import Outbox, OutboxFullError, RECORD_HEADER, FSYNC_NEVER
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            try:
+                outbox.close()
+            except ValueError:
+                # Already closed by the test
+                pass
+        shutil.rmtree(self.directory)
+
+    def open(self, **kwargs):
+        outbox = Outbox(self.directory, **{"segment_size": 4096, "max_bytes": 4096 * 4, **kwargs})
+        self.outboxes.append(outbox)
+        return outbox
+
+    def reopen(self, outbox, **kwargs):
+        outbox.close()
+        return self.open(**kwargs)
+
+    def segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, "*.seg")))
+
+    def drain(self, outbox):
+        bodies = []
+        while True:
+            record = outbox.peek()
+            if record is None:
+                return bodies
+            bodies.append(record.body)
+            outbox.commit()
+
+    def test_append_peek_commit_in_order(self):
+        outbox = self.open()
+        properties = pika.BasicProperties(delivery_mode=2, headers={"x-test": 1}, content_encoding="gzip")
+        outbox.append("ex", "key", properties, "first")
+        outbox.append("", "queue", None, b"second")
+
+        record = outbox.peek()
+        self.assertEqual((record.exchange, record.routing_key, record.body), ("ex", "key", b"first"))
+        self.assertEqual(record.properties, {"delivery_mode": 2, "headers": {"x-test": 1}, "content_encoding": "gzip"})
+        # Peeking again without a commit returns the same message
+        self.assertEqual(outbox.peek().body, b"first")
+        outbox.commit()
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(self.drain(outbox), [b"second"])
+        self.assertEqual(len(outbox), 0)
+        self.assertIsNone(outbox.peek())
+
+    def test_reopen_keeps_unflushed_messages(self):
+        outbox = self.open()
+        for i in range(5):
+            outbox.append("", "queue", None, f"message {i}")
+        outbox.peek()
+        outbox.commit()
+
+        outbox = self.reopen(outbox)
+        self.assertEqual(len(outbox), 4)
+        self.assertEqual(self.drain(outbox), [f"message {i}".encode() for i in range(1, 5)])
+
+    def test_torn_record_is_dropped_on_reopen(self):
+        outbox = self.open()
+        outbox.append("", "queue", None, b"kept")
+        outbox.append("", "queue", None, b"torn")
+        segment = outbox._segments[-1]
+        torn_offset = segment.offsets[-1]
+        # Corrupt the body of the last record, its CRC no longer matches
+        segment.map[torn_offset + RECORD_HEADER.size + 5] ^= 0xFF
+
+        outbox = self.reopen(outbox)
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(self.drain(outbox), [b"kept"])
+        # The torn record's slot is reused by the next append
+        outbox.append("", "queue", None, b"after")
+        self.assertEqual(outbox._segments[-1].offsets[-1], torn_offset)
+        self.assertEqual(self.drain(outbox), [b"after"])
+
+    def test_records_missing_from_index_are_recovered(self):
+        outbox = self.open()
+        for i in range(3):
+            outbox.append("", "queue", None, f"message {i}")
+        index_path = outbox._segments[-1].index_path
+        outbox.close()
+        # Crash after the record was written, before its index entry (plus a torn entry)
+        with open(index_path, "r+b") as f:
+            f.truncate(8 + 3)
+
+        outbox = self.open()
+        self.assertEqual(self.drain(outbox), [f"message {i}".encode() for i in range(3)])
+
+    def test_flushed_segments_are_deleted(self):
+        outbox = self.open()
+        body = b"x" * 1000
+        for _ in range(8):
+            outbox.append("", "queue", None, body)
+        self.assertGreater(len(self.segment_paths()), 1)
+
+        self.assertEqual(len(self.drain(outbox)), 8)
+        self.assertEqual(len(self.segment_paths()), 1)
+
+        # The cursor survives the segment cleanup
+        outbox.append("", "queue", None, b"last")
+        outbox = self.reopen(outbox)
+        self.assertEqual(self.drain(outbox), [b"last"])
+
+    def test_full_outbox_raises(self):
+        outbox = self.open(max_bytes=4096 * 2, fsync=FSYNC_NEVER)
+        with self.assertRaises(OutboxFullError):
+            for _ in range(100):
+                outbox.append("", "queue", None, b"x" * 1000)
+        with self.assertRaises(OutboxFullError):
+            outbox.append("", "queue", None, b"x" * 5000)
+        # What fitted is still there, in order
+        self.assertGreater(len(outbox), 0)
+
+if __name__ == "__main__":
+    unittest.main()
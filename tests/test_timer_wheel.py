@@ -0,0 +1,94 @@
+import unittest
+
+from unittest import mock
+
+from models.timer_wheel import TimerWheel
+
+class TimerWheelTest(unittest.TestCase):
+    """Drives the wheel by hand with `_advance`, no thread and no sleeping"""
+    def make_wheel(self, now=1000.0, tick=1.0, slots=8):
+        self.fired = []
+        with mock.patch("models.timer_wheel.time.time", return_value=now):
+            return TimerWheel(lambda timer_id, payload: self.fired.append((timer_id, payload)), tick=tick, slots=slots)
+
+    def advance_to(self, wheel, timestamp):
+        wheel._advance(wheel._tick_of(timestamp))
+
+    def test_never_fires_before_deadline(self):
+        wheel = self.make_wheel(now=1000.0, tick=1.0)
+        wheel.schedule("a", 1002.5, "payload")
+        for now in (1001.0, 1002.0, 1002.4, 1002.99):
+            self.advance_to(wheel, now)
+            self.assertEqual(self.fired, [], f"fired early at {now}")
+        self.advance_to(wheel, 1003.0)
+        self.assertEqual(self.fired, [("a", "payload")])
+        self.assertEqual(len(wheel), 0)
+
+    def test_fractional_tick_never_fires_early(self):
+        wheel = self.make_wheel(now=0.0, tick=0.1, slots=16)
+        deadlines = [0.05 + i * 0.037 for i in range(40)]
+        for i, deadline in enumerate(deadlines):
+            wheel.schedule(i, deadline)
+        now = 0.0
+        while len(wheel):
+            now += 0.01
+            self.advance_to(wheel, now)
+            for timer_id, _ in self.fired:
+                self.assertGreaterEqual(now + 1e-9, deadlines[timer_id])
+            self.fired.clear()
+
+    def test_deadline_beyond_one_revolution(self):
+        wheel = self.make_wheel(now=1000.0, tick=1.0, slots=8)
+        # Same bucket as tick 1003, one revolution later
+        wheel.schedule("far", 1011.0)
+        self.advance_to(wheel, 1003.0)
+        self.assertEqual(self.fired, [])
+        self.advance_to(wheel, 1010.0)
+        self.assertEqual(self.fired, [])
+        self.advance_to(wheel, 1011.0)
+        self.assertEqual([timer_id for timer_id, _ in self.fired], ["far"])
+
+    def test_past_deadline_fires_on_next_tick(self):
+        wheel = self.make_wheel(now=1000.0)
+        wheel.schedule("late", 900.0)
+        self.advance_to(wheel, 1001.0)
+        self.assertEqual([timer_id for timer_id, _ in self.fired], ["late"])
+
+    def test_cancel_and_reschedule(self):
+        wheel = self.make_wheel(now=1000.0)
+        wheel.schedule("cancelled", 1002.0)
+        wheel.schedule("moved", 1002.0)
+        self.assertTrue(wheel.cancel("cancelled"))
+        self.assertFalse(wheel.cancel("cancelled"))
+        wheel.schedule("moved", 1005.0)
+        self.assertEqual(len(wheel), 1)
+
+        self.advance_to(wheel, 1004.0)
+        self.assertEqual(self.fired, [])
+        self.advance_to(wheel, 1005.0)
+        self.assertEqual([timer_id for timer_id, _ in self.fired], ["moved"])
+
+    def test_long_pause_expires_everything_due(self):
+        wheel = self.make_wheel(now=1000.0, slots=8)
+        for i in range(1, 30):
+            wheel.schedule(i, 1000.0 + i)
+        self.advance_to(wheel, 1100.0)
+        self.assertEqual(sorted(timer_id for timer_id, _ in self.fired), list(range(1, 30)))
+
+    def test_failing_handler_does_not_stop_the_others(self):
+        fired = []
+
+        def on_expire(timer_id, payload):
+            if timer_id == "bad":
+                raise RuntimeError("boom")
+            fired.append(timer_id)
+
+        with mock.patch("models.timer_wheel.time.time", return_value=1000.0):
+            wheel = TimerWheel(on_expire, tick=1.0, slots=8, logger=mock.Mock())
+        wheel.schedule("bad", 1001.0)
+        wheel.schedule("good", 1001.0)
+        wheel._advance(1001)
+        self.assertEqual(fired, ["good"])
+
+if __name__ == "__main__":
+    unittest.main()
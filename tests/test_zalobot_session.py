@@ -0,0 +1,44 @@
+import unittest
+
+from unittest import mock
+
+from zlapi.models import User
+
+from models.zalobot import ZaloBot
+
+def make_snapshot():
+    return {
+        "cookies": {"zpw_sek": "cookie"},
+        "secret_key": "c2VjcmV0",
+        "imei": "imei-1",
+        "user_id": None,
+        "config": {"phone_number": "0900000000", "secret_key": "c2VjcmV0", "send2me_id": "42"},
+    }
+
+class RestoreSessionTest(unittest.TestCase):
+    def make_bot(self):
+        return ZaloBot(phone="0900000000", password="secret", imei="imei-1", auto_login=False, logger=mock.Mock())
+
+    def test_fresh_snapshot_is_restored_without_login(self):
+        bot = self.make_bot()
+        profile = User.fromDict({"profile": {"userId": "42"}}, None)
+        with mock.patch.object(ZaloBot, "login") as login, \
+                mock.patch.object(ZaloBot, "fetchAccountInfo", return_value=profile) as fetch:
+            self.assertTrue(bot.restore_session(make_snapshot()))
+        login.assert_not_called()
+        fetch.assert_called_once()
+        self.assertTrue(bot.isLoggedIn())
+        self.assertEqual(bot.user_id, "42")
+        self.assertEqual(bot.getSecretKey(), "c2VjcmV0")
+        self.assertEqual(bot.getSession(), {"zpw_sek": "cookie"})
+
+    def test_rejected_session_is_not_restored(self):
+        bot = self.make_bot()
+        with mock.patch.object(ZaloBot, "login") as login, \
+                mock.patch.object(ZaloBot, "fetchAccountInfo", side_effect=Exception("Error #-1 when sending requests")):
+            self.assertFalse(bot.restore_session(make_snapshot()))
+        login.assert_not_called()
+        self.assertFalse(bot.isLoggedIn())
+
+if __name__ == "__main__":
+    unittest.main()
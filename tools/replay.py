@@ -0,0 +1,87 @@
+"""
+Replay the messages of a dead-letter / parking queue at a controlled rate.
+
+Usage (from the repository root):
+    python -m tools.replay --source <PREFIX_ID>_NOTIFY_ZALO.parking --rate 2 --action-type SEND_OTP --max-age 3600 --dry-run
+"""
+import sys
+import argparse
+
+from models.rabbitmq import RabbitMQ
+from models.replay import QueueReplayer
+from models.tenant import Tenant
+from utils.config import get_prefix_id
+from utils.logger import setup_logger
+
+logger = setup_logger("Replay", log_file="replay.log")
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="queue to replay from")
+    parser.add_argument("--target", help="queue to replay to (default: <PREFIX_ID>_NOTIFY_ZALO)")
+    parser.add_argument("--prefix-id", default=get_prefix_id(), help="tenant of the default target queue")
+    parser.add_argument("--rate", type=positive_float, default=1.0, help="messages per second (default: 1)")
+    parser.add_argument("--action-type", action="append", dest="action_types", help="only replay this action type (repeatable)")
+    parser.add_argument("--min-age", type=float, help="only replay messages at least this many seconds old")
+    parser.add_argument("--max-age", type=float, help="only replay messages at most this many seconds old")
+    parser.add_argument("--limit", type=int, help="stop after this many matching messages")
+    parser.add_argument("--dry-run", action="store_true", help="count the matching messages, replay nothing")
+    parser.add_argument("--checkpoint", help="progress file (default: data/replay_<source>.json)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    target = args.target or (Tenant(args.prefix_id).queue_name if args.prefix_id else None)
+    if not target:
+        logger.error("No target queue: pass --target or set PREFIX_ID.")
+        return 1
+    if args.source == target:
+        logger.error("Source and target queues must differ.")
+        return 1
+
+    # The outbox belongs to the running service, and every replayed message is confirmed by the broker itself
+    rabbitmq = RabbitMQ(use_outbox=False)
+    if not rabbitmq.connect():
+        return 1
+
+    replayer = QueueReplayer(
+        rabbitmq,
+        source=args.source,
+        target=target,
+        rate=args.rate,
+        action_types=set(args.action_types) if args.action_types else None,
+        min_age=args.min_age,
+        max_age=args.max_age,
+        limit=args.limit,
+        dry_run=args.dry_run,
+        checkpoint_path=args.checkpoint or f"data/replay_{args.source}.json",
+        logger=logger,
+    )
+    try:
+        progress = replayer.run()
+    except KeyboardInterrupt:
+        logger.info("Interrupted, progress saved. Run again to carry on.")
+        progress = replayer.progress
+    except Exception as e:
+        logger.error(f"Replay failed: {e}")
+        return 1
+    finally:
+        rabbitmq.close()
+
+    matched = progress.get("matched") or dict(replayer.matched_by_action)
+    if args.dry_run:
+        logger.info(f"Dry run: {sum(matched.values())} message(s) would be replayed from {args.source} to {target}, {progress['skipped']} filtered out.")
+    else:
+        logger.info(f"Replayed {progress['replayed']} message(s) from {args.source} to {target}, {progress['skipped']} filtered out, {progress['failed']} refused.")
+    for action_type, count in sorted(matched.items()):
+        logger.info(f"  {action_type}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
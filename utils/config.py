@@ -8,13 +8,29 @@ logger = get_logger("Config")
 
 load_dotenv()
 
+# Credentials a tenant with its own Zalo account must give, none of them falls back to .env
+TENANT_CREDENTIAL_FIELDS = ("phone", "password", "imei", "cookies_path")
+
 # Tải thông tin tài khoản Zalo
-def load_zalo_credentials():
-    """Load Zalo credentials from .env and cookies file"""
-    phone = os.getenv("ZALO_PHONE")
-    password = os.getenv("ZALO_PASSWORD")
-    imei = os.getenv("ZALO_IMEI")
-    cookies_filepath = os.getenv("ZALO_COOKIES_PATH")
+def load_zalo_credentials(config=None):
+    """
+    Load Zalo credentials from .env and cookies file
+
+    `config` holds the credentials of a tenant with its own Zalo account
+    (keys: phone, password, imei, cookies_path). They are all required, a
+    missing one stops the process rather than mixing in the .env account.
+    """
+    if config:
+        missing = [field for field in TENANT_CREDENTIAL_FIELDS if not config.get(field)]
+        if missing:
+            logger.error(f"Missing tenant Zalo credentials: {', '.join(missing)}.")
+            sys.exit(1)
+        phone, password, imei, cookies_filepath = (config[field] for field in TENANT_CREDENTIAL_FIELDS)
+    else:
+        phone = os.getenv("ZALO_PHONE")
+        password = os.getenv("ZALO_PASSWORD")
+        imei = os.getenv("ZALO_IMEI")
+        cookies_filepath = os.getenv("ZALO_COOKIES_PATH")
 
     if not any([phone, password, imei, cookies_filepath]):
         logger.error("Missing Zalo credentials.")
@@ -43,4 +59,66 @@ def get_base_url():
     return os.getenv("BASE_URL")
 
 def get_prefix_id():
-    return os.getenv("PREFIX_ID")
\ No newline at end of file
+    return os.getenv("PREFIX_ID")
+
+def get_session_snapshot_path(prefix_id=None):
+    """Path of the saved Zalo session snapshot (cookies + login state)"""
+    path = os.getenv("ZALO_SESSION_PATH", "data/session.json")
+    if prefix_id:
+        # One snapshot per tenant account
+        root, ext = os.path.splitext(path)
+        path = f"{root}_{prefix_id}{ext}"
+    return path
+
+def get_session_snapshot_ttl():
+    """Max age (seconds) of a session snapshot before a full login is forced"""
+    return int(os.getenv("ZALO_SESSION_TTL", 7 * 24 * 3600))
+
+def is_startup_timing_enabled():
+    return os.getenv("STARTUP_TIMING", "").lower() in ("1", "true", "yes")
+
+def is_adaptive_prefetch_enabled():
+    return os.getenv("PREFETCH_ADAPTIVE", "").lower() in ("1", "true", "yes")
+
+def get_mongodb_db_name():
+    return os.getenv("MONGODB_DB", "zalobot")
+
+def load_tenants_config():
+    """
+    Tenants consumed by this process.
+
+    TENANTS_CONFIG is the path of a JSON file listing the tenants:
+    `[{"prefix_id": "...", "base_url": "...", "zalo": {"phone": ..., "password": ..., "imei": ..., "cookies_path": ...}}]`.
+    `base_url` defaults to BASE_URL, tenants without `zalo` share the account of the .env file.
+    Without TENANTS_CONFIG, the single tenant PREFIX_ID is used.
+    """
+    config_path = os.getenv("TENANTS_CONFIG")
+    if not config_path:
+        return [{"prefix_id": get_prefix_id(), "base_url": get_base_url(), "zalo": None}]
+
+    try:
+        with open(config_path, "r") as f:
+            tenants = json.load(f)
+    except FileNotFoundError:
+        logger.error("Tenants config file not found.")
+        sys.exit(1)
+    except json.JSONDecodeError:
+        logger.error("Failed to decode tenants config. Check the TENANTS_CONFIG file.")
+        sys.exit(1)
+
+    if not isinstance(tenants, list) or not all(isinstance(t, dict) and t.get("prefix_id") for t in tenants):
+        logger.error("Tenants config must be a list of objects with a prefix_id.")
+        sys.exit(1)
+
+    return [
+        {
+            "prefix_id": tenant["prefix_id"],
+            "base_url": tenant.get("base_url") or get_base_url(),
+            "zalo": tenant.get("zalo")
+        }
+        for tenant in tenants
+    ]
+
+def get_health_server_address():
+    """(host, port) of the health endpoint, port 0 disables it"""
+    return os.getenv("HEALTH_HOST", "127.0.0.1"), int(os.getenv("HEALTH_PORT", 8080))
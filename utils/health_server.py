@@ -0,0 +1,77 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from utils.logger import get_logger
+
+# Route handler: receives the query string parameters, returns (status code, JSON payload)
+RouteHandler = Callable[[Dict[str, List[str]]], Tuple[int, Any]]
+
+class HealthServer:
+    """
+    Small JSON HTTP server for liveness, readiness and metrics probes.
+
+    Routes are registered with `route`, each request is served on its own
+    thread so a slow probe never blocks the others.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, logger=None):
+        self.host = host
+        self.port = port
+        self.logger = logger or get_logger("HealthServer")
+        self._routes: Dict[str, RouteHandler] = {}
+        self._server = None
+        self._thread = None
+
+    def route(self, path: str, handler: RouteHandler):
+        self._routes[path] = handler
+
+    def start(self) -> bool:
+        """Serve in the background. Returns False if the port can't be bound (the service runs without probes)."""
+        routes = self._routes
+        logger = self.logger
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                handler = routes.get(url.path)
+                if handler is None:
+                    return self._send(404, {"error": "not found"})
+                try:
+                    status, payload = handler(parse_qs(url.query))
+                except Exception as e:
+                    logger.error(f"Health route {url.path} failed: {e}")
+                    status, payload = 500, {"error": str(e)}
+                self._send(status, payload)
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Probes hit the server every few seconds, keep them out of the logs
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        except OSError as e:
+            # e.g. the port is already in use, probes are not worth failing the startup for
+            self.logger.error(f"Failed to start health server on {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="health-server", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Health server listening on {self.host}:{self.port}")
+        return True
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,42 @@
+import time
+import threading
+
+from utils.logger import get_logger
+
+class StartupTimer:
+    """
+    Record the time of startup phases relative to process start.
+
+    Each phase is recorded only once, so hot paths (e.g. the message
+    callback) can call `mark` unconditionally.
+    """
+    def __init__(self):
+        self.enabled = False
+        # Phase that ends the measurement, the full report is logged when it is reached
+        self.final_phase = "first_message"
+        self._start = time.perf_counter()
+        self._marks = {}
+        self._lock = threading.Lock()
+        self.logger = get_logger("Startup")
+
+    def mark(self, phase):
+        if not self.enabled or phase in self._marks:
+            return
+        with self._lock:
+            if phase in self._marks:
+                return
+            self._marks[phase] = time.perf_counter() - self._start
+        self.logger.info(f"[startup] {phase}: {self._marks[phase]:.3f}s")
+        if phase == self.final_phase:
+            self.logger.info(f"[startup] report: {self.report()}")
+
+    def elapsed(self, phase):
+        return self._marks.get(phase)
+
+    def report(self):
+        """Summary of all recorded phases, in the order they happened"""
+        phases = sorted(self._marks.items(), key=lambda item: item[1])
+        return ", ".join(f"{phase}={elapsed:.3f}s" for phase, elapsed in phases)
+
+# Shared timer for the whole process
+startup_timer = StartupTimer()